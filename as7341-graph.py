@@ -1,13 +1,8 @@
-import os
-
-if 'BLINKA_MCP2221' not in os.environ: 
-    os.environ['BLINKA_MCP2221'] = '1'
-
 from time import sleep
-import board
+import bus
 from adafruit_as7341 import AS7341
 
-i2c = board.I2C()
+i2c = bus.I2C()
 sensor = AS7341(i2c)
  
  
@@ -16,7 +11,7 @@ def bar_graph(read_value):
     return "[%5d] " % read_value + (scaled * "*")
  
 
-data = sensor.all_channels()
+data = sensor.all_channels
 print("F1 - 415nm/Violet  %s" % bar_graph(data[0]))
 print("F2 - 445nm/Indigo  %s" % bar_graph(data[1]))
 print("F3 - 480nm/Blue    %s" % bar_graph(data[2]))
@@ -0,0 +1,260 @@
+"""
+Vectorised processing of AS7341 spectral frames.
+
+Frames are the tuples returned by ``AS7341.all_channels()`` stacked into an
+``(N, 8)`` array (F1-F8) or an ``(N, 10)`` array (F1-F8, Clear, NIR). Every
+function operates on the whole batch at once so thousands of frames can be
+processed without a Python loop.
+"""
+import numpy as np
+
+# Channel centre wavelengths in nm (F1-F8)
+CHANNEL_WAVELENGTHS = (415, 445, 480, 515, 555, 590, 630, 680)
+CHANNEL_NAMES = ("F1", "F2", "F3", "F4", "F5", "F6", "F7", "F8", "Clear", "NIR")
+
+# Integration step of the AS7341 in ms
+_ASTEP_UNIT_MS = 2.78e-3
+
+# Gain factors indexed by the driver's Gain enum (GAIN_0_5X ... GAIN_512X)
+_GAIN_VALUES = (0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Approximate calibration: CIE 1931 2-degree colour matching functions sampled
+# at the F1-F8 centre wavelengths. Replace with a per-unit calibration matrix
+# for anything better than a relative estimate.
+DEFAULT_XYZ_MATRIX = np.array([
+    [0.0776, 0.3481, 0.0956, 0.0291, 0.5121, 1.0263, 0.6424, 0.0468],
+    [0.0022, 0.0298, 0.1390, 0.6082, 1.0000, 0.7570, 0.2650, 0.0170],
+    [0.3713, 1.7826, 0.8130, 0.1117, 0.0057, 0.0011, 0.0000, 0.0000],
+])
+
+# Scale from Y (in basic counts) to lux for the default matrix
+DEFAULT_LUX_SCALE = 1.0
+
+
+def as_frames(data):
+    """
+    Convert channel readings to a float64 frame array
+
+    :param data: A single ``all_channels()`` tuple or a sequence of them
+    :type data: array_like
+    :return: Frames with shape (N, channels)
+    :rtype: numpy.ndarray
+    """
+    frames = np.asarray(data, dtype=np.float64)
+    if frames.ndim == 1:
+        frames = frames[np.newaxis, :]
+    if frames.ndim != 2 or frames.shape[1] not in (8, 10):
+        raise ValueError("expected frames of 8 or 10 channels, got shape %s" % (frames.shape,))
+    return frames
+
+
+def integration_time_ms(atime, astep):
+    """
+    Get the integration time for the given ATIME/ASTEP settings
+
+    :param atime: ATIME register value (0-255)
+    :type atime: int or array_like
+    :param astep: ASTEP register value (0-65534)
+    :type astep: int or array_like
+    :return: Integration time in ms
+    :rtype: float or numpy.ndarray
+    """
+    return (np.asarray(atime) + 1) * (np.asarray(astep) + 1) * _ASTEP_UNIT_MS
+
+
+def gain_factor(gain):
+    """
+    Get the multiplication factor for an AS7341 gain setting
+
+    :param gain: ``Gain`` enum value as used by the driver (0 = 0.5x ... 10 = 512x)
+    :type gain: int or array_like
+    :return: Gain factor
+    :rtype: float or numpy.ndarray
+    """
+    return np.take(_GAIN_VALUES, np.asarray(gain, dtype=np.intp))
+
+
+def dark_subtract(frames, dark):
+    """
+    Subtract a dark reading from every frame, clipping at zero
+
+    :param frames: Frames with shape (N, channels)
+    :type frames: numpy.ndarray
+    :param dark: Dark frame(s), either (channels,) or (N, channels)
+    :type dark: array_like
+    :return: Dark corrected frames
+    :rtype: numpy.ndarray
+    """
+    return np.clip(frames - np.asarray(dark, dtype=np.float64), 0, None)
+
+
+def basic_counts(frames, gain, atime, astep):
+    """
+    Normalise raw counts to basic counts (counts per ms at 1x gain)
+
+    Gain and integration settings may be scalars or per-frame arrays so
+    batches captured with auto-gain can be normalised together.
+
+    :param frames: Frames with shape (N, channels)
+    :type frames: numpy.ndarray
+    :param gain: ``Gain`` enum value(s)
+    :type gain: int or array_like
+    :param atime: ATIME register value(s)
+    :type atime: int or array_like
+    :param astep: ASTEP register value(s)
+    :type astep: int or array_like
+    :return: Basic counts with shape (N, channels)
+    :rtype: numpy.ndarray
+    """
+    scale = gain_factor(gain) * integration_time_ms(atime, astep)
+    scale = np.asarray(scale, dtype=np.float64)
+    if scale.ndim == 1:
+        scale = scale[:, np.newaxis]
+    return frames / scale
+
+
+def to_xyz(counts, matrix=DEFAULT_XYZ_MATRIX):
+    """
+    Apply a calibration matrix to get CIE XYZ tristimulus values
+
+    :param counts: Basic counts with shape (N, channels)
+    :type counts: numpy.ndarray
+    :param matrix: Calibration matrix with shape (3, channels used)
+    :type matrix: numpy.ndarray
+    :return: XYZ values with shape (N, 3)
+    :rtype: numpy.ndarray
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    return counts[:, :matrix.shape[1]] @ matrix.T
+
+
+def chromaticity(xyz):
+    """
+    Get the CIE 1931 xy chromaticity coordinates
+
+    :param xyz: XYZ values with shape (N, 3)
+    :type xyz: numpy.ndarray
+    :return: xy coordinates with shape (N, 2), NaN where XYZ sums to zero
+    :rtype: numpy.ndarray
+    """
+    total = xyz.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xy = xyz[:, :2] / total
+    xy[total[:, 0] == 0] = np.nan
+    return xy
+
+
+def lux(xyz, scale=DEFAULT_LUX_SCALE):
+    """
+    Get the illuminance from XYZ values
+
+    :param xyz: XYZ values with shape (N, 3)
+    :type xyz: numpy.ndarray
+    :param scale: Calibration from Y to lux
+    :type scale: float
+    :return: Illuminance in lux with shape (N,)
+    :rtype: numpy.ndarray
+    """
+    return xyz[:, 1] * scale
+
+
+def cct(xyz):
+    """
+    Get the correlated colour temperature using McCamy's approximation
+
+    :param xyz: XYZ values with shape (N, 3)
+    :type xyz: numpy.ndarray
+    :return: CCT in K with shape (N,)
+    :rtype: numpy.ndarray
+    """
+    xy = chromaticity(xyz)
+    n = (xy[:, 0] - 0.3320) / (0.1858 - xy[:, 1])
+    return 449.0 * n ** 3 + 3525.0 * n ** 2 + 6823.3 * n + 5520.33
+
+
+def process(data, gain, atime, astep, dark=None, matrix=DEFAULT_XYZ_MATRIX, lux_scale=DEFAULT_LUX_SCALE):
+    """
+    Run the full processing chain over a batch of frames
+
+    :param data: Raw channel readings, (channels,) or (N, channels)
+    :type data: array_like
+    :param gain: ``Gain`` enum value(s)
+    :type gain: int or array_like
+    :param atime: ATIME register value(s)
+    :type atime: int or array_like
+    :param astep: ASTEP register value(s)
+    :type astep: int or array_like
+    :param dark: Optional dark frame(s) to subtract
+    :type dark: array_like
+    :param matrix: Calibration matrix with shape (3, channels used)
+    :type matrix: numpy.ndarray
+    :param lux_scale: Calibration from Y to lux
+    :type lux_scale: float
+    :return: Arrays keyed by name: raw, counts, xyz, lux and cct
+    :rtype: dict
+    """
+    raw = as_frames(data)
+    frames = raw if dark is None else dark_subtract(raw, dark)
+    counts = basic_counts(frames, gain, atime, astep)
+    xyz = to_xyz(counts, matrix)
+    return {
+        "raw": raw,
+        "counts": counts,
+        "xyz": xyz,
+        "lux": lux(xyz, lux_scale),
+        "cct": cct(xyz),
+    }
+
+
+def save_batch(path, results, timestamps=None):
+    """
+    Export processed frames for offline analysis
+
+    The format is chosen from the file extension: ``.npz`` writes a
+    compressed NumPy archive, ``.parquet`` writes one row per frame and
+    requires pyarrow.
+
+    :param path: Output file path
+    :type path: str
+    :param results: Arrays as returned by :func:`process`
+    :type results: dict
+    :param timestamps: Optional per-frame timestamps
+    :type timestamps: array_like
+    """
+    arrays = dict(results)
+    if timestamps is not None:
+        arrays["timestamp"] = np.asarray(timestamps, dtype=np.float64)
+
+    if str(path).endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("pyarrow is required for Parquet export")
+
+        columns = {}
+        for name, values in arrays.items():
+            if values.ndim == 1:
+                columns[name] = values
+            elif name == "xyz":
+                for i, axis in enumerate("XYZ"):
+                    columns[axis] = values[:, i]
+            else:
+                for i in range(values.shape[1]):
+                    columns["%s_%s" % (name, CHANNEL_NAMES[i])] = values[:, i]
+        pq.write_table(pa.table(columns), path)
+    else:
+        np.savez_compressed(path, **arrays)
+
+
+def load_batch(path):
+    """
+    Load a batch written by :func:`save_batch` in NPZ format
+
+    :param path: Input file path
+    :type path: str
+    :return: Arrays keyed by name
+    :rtype: dict
+    """
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
@@ -0,0 +1,182 @@
+"""
+Non-blocking logging for the pollers.
+
+The sampling loop only puts records on a bounded queue. A background thread
+formats them, writes them in batches and rotates the log file by size, so a
+slow SD card never delays the next sensor read. Records that do not fit in
+the queue are dropped and counted instead of blocking.
+"""
+import logging
+import logging.handlers
+import queue
+import threading
+
+DEFAULT_FORMAT = '%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s'
+DEFAULT_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks and leaves formatting to the listener
+
+    Message arguments are formatted on the listener thread, so they must not
+    be mutated after logging.
+
+    :param queue.Queue log_queue: Bounded queue shared with the listener
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating file handler that writes a batch of records with one flush"""
+    def emit_batch(self, records):
+        lines = [self.format(record) + self.terminator for record in records if self.filter(record)]
+        if not lines:
+            return
+        data = "".join(lines)
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0 and self.stream.tell() and self.stream.tell() + len(data) >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(data)
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(records[-1])
+        finally:
+            self.release()
+
+
+class BatchListener:
+    """
+    Background thread draining the log queue in batches
+
+    :param queue.Queue log_queue: Queue filled by a `DroppingQueueHandler`
+    :param handler: Handler writing the records, batches are passed to its
+        ``emit_batch`` method if it has one
+    :param DroppingQueueHandler source: Handler whose drops are reported
+    :param int batch_size: Maximum records per write. Defaults to 100.
+    :param float flush_interval: Maximum time in s a record waits for a batch
+        to fill. Defaults to 1.0.
+    """
+    _STOP = object()
+
+    def __init__(self, log_queue, handler, source=None, batch_size=100, flush_interval=1.0):
+        self.queue = log_queue
+        self.handler = handler
+        self.source = source
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._reported = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def dropped(self):
+        """Number of records dropped because the queue was full"""
+        return self.source.dropped if self.source else 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Write out all queued records and stop the thread"""
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self.handler.close()
+
+    def _drops_record(self):
+        dropped = self.dropped
+        if dropped == self._reported:
+            return None
+        record = logging.makeLogRecord({
+            "name": __name__,
+            "levelno": logging.WARNING,
+            "levelname": logging.getLevelName(logging.WARNING),
+            "msg": "%d log records dropped, queue full",
+            "args": (dropped - self._reported,),
+        })
+        self._reported = dropped
+        return record
+
+    def _write(self, records):
+        emit_batch = getattr(self.handler, "emit_batch", None)
+        if emit_batch:
+            emit_batch(records)
+        else:
+            for record in records:
+                self.handler.handle(record)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                records = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                records = []
+            while len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self._STOP in records:
+                records.remove(self._STOP)
+                stopping = True
+
+            dropped = self._drops_record()
+            if dropped:
+                records.append(dropped)
+            if records:
+                self._write(records)
+
+
+def basic_config(filename=None, level=logging.INFO, fmt=DEFAULT_FORMAT, datefmt=DEFAULT_DATEFMT,
+                 max_bytes=1024 * 1024, backup_count=5, queue_size=1000, batch_size=100, flush_interval=1.0):
+    """
+    Configure the root logger for non-blocking logging
+
+    Like ``logging.basicConfig``, but records are handed to a background
+    thread. Call ``stop()`` on the returned listener before exiting so the
+    queued records are written.
+
+    :param str filename: Log file, rotated at ``max_bytes``. Logs to stderr if
+        None.
+    :param int level: Root logger level
+    :param str fmt: Record format
+    :param str datefmt: Date format
+    :param int max_bytes: Size at which the log file is rotated, 0 to disable
+    :param int backup_count: Rotated files to keep
+    :param int queue_size: Records buffered before dropping
+    :param int batch_size: Maximum records per write
+    :param float flush_interval: Maximum time in s before queued records are
+        written
+    :return: The started listener
+    :rtype: BatchListener
+    """
+    if filename:
+        handler = BatchRotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(fmt, datefmt))
+
+    log_queue = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    listener = BatchListener(log_queue, handler, queue_handler, batch_size, flush_interval)
+    listener.start()
+    return listener
@@ -0,0 +1,493 @@
+"""
+Benchmarks for the hot paths of the scripts in this repo.
+
+Each scenario runs against a simulated bus (default), the live adapter or a
+replayed trace and reports wall time, bus transactions, bytes transferred and
+allocations. Results can be saved as a baseline and later runs compared
+against it with a regression threshold.
+
+    python benchmark.py                      # simulated bus
+    python benchmark.py --bus live --record traces/
+    python benchmark.py --bus live --allow-nvm-writes stusb4500_write
+    python benchmark.py --bus replay --traces traces/
+    python benchmark.py --save-baseline
+
+The committed baseline covers the simulated bus. Wall times depend on the
+machine, so re-save it on the machine that runs the comparison.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+DEFAULT_BASELINE = "benchmark-baseline.json"
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_MIN_TIME = 0.05
+# Wall time differences below this are ignored; on the simulated bus the
+# sub-ms scenarios vary by more than 50 % between interpreter runs
+DEFAULT_MIN_DELTA = 0.0005
+# Wall time may also grow by this many times the measured relative spread
+NOISE_FACTOR = 3
+
+
+class CountingI2C:
+    """
+    ``busio.I2C`` wrapper counting transactions and bytes
+
+    Setups that put the bus behind a `sim_bus.SimMCP2221` set ``hid`` to it,
+    so the HID reports are counted as well.
+    """
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.hid = None
+        self.transactions = 0
+        self.bytes = 0
+
+    def reset(self):
+        self.transactions = 0
+        self.bytes = 0
+        if self.hid:
+            self.hid.reports = 0
+
+    def try_lock(self):
+        return self.i2c.try_lock()
+
+    def unlock(self):
+        self.i2c.unlock()
+
+    def scan(self):
+        found = self.i2c.scan()
+        self.transactions += 1
+        return found
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        self.i2c.writeto(address, buffer, start=start, end=end)
+        self.transactions += 1
+        self.bytes += end - start
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        self.i2c.readfrom_into(address, buffer, start=start, end=end)
+        self.transactions += 1
+        self.bytes += end - start
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        out_end = len(buffer_out) if out_end is None else out_end
+        in_end = len(buffer_in) if in_end is None else in_end
+        self.i2c.writeto_then_readfrom(address, buffer_out, buffer_in, out_start=out_start, out_end=out_end,
+                                       in_start=in_start, in_end=in_end)
+        self.transactions += 1
+        self.bytes += out_end - out_start + in_end - in_start
+
+    def deinit(self):
+        self.i2c.deinit()
+
+
+# Scenarios: setup(i2c) returns the state passed to run(state). Only run() is
+# measured. Scenarios that cannot run on the simulated bus set sim=False.
+
+def _stusb4500(i2c):
+    from stusb4500 import STUSB4500
+    return STUSB4500(i2c)
+
+
+class _BlinkaI2C:
+    """``busio.I2C`` over the I2C methods of Blinka's ``MCP2221``"""
+    def __init__(self, mcp):
+        self._mcp = mcp
+        self._lock = threading.Lock()
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return self._mcp.i2c_scan()
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._mcp.i2c_writeto(address, buffer, start=start, end=end)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        self._mcp.i2c_readfrom_into(address, buffer, start=start, end=end)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        self._mcp.i2c_writeto_then_readfrom(address, buffer_out, buffer_in, out_start=out_start,
+                                            out_end=out_end, in_start=in_start, in_end=in_end)
+
+
+def _blinka_mcp2221(device):
+    """Blinka's ``MCP2221`` driving the given HID device"""
+    import hid
+
+    # Importing the module opens the first adapter, hand it the simulated
+    # one instead so this also works without hardware
+    hid_device = hid.device
+    hid.device = lambda: device
+    try:
+        from adafruit_blinka.microcontroller.mcp2221.mcp2221 import MCP2221
+    finally:
+        hid.device = hid_device
+
+    # Skip the adapter reset and GPIO setup of __init__
+    mcp = MCP2221.__new__(MCP2221)
+    mcp._hid = device  # pylint: disable=protected-access
+    return mcp
+
+
+def _stusb4500_hid(i2c):
+    from mcp2221_batch import BatchingI2C, MCP2221HID
+    from sim_bus import SimMCP2221
+
+    i2c.hid = SimMCP2221(i2c)
+    return _stusb4500(BatchingI2C(MCP2221HID(i2c.hid)))
+
+
+def _stusb4500_hid_blinka(i2c):
+    from sim_bus import SimMCP2221
+
+    i2c.hid = SimMCP2221(i2c)
+    return _stusb4500(_BlinkaI2C(_blinka_mcp2221(i2c.hid)))
+
+
+def _stusb4500_write(i2c):
+    pd = _stusb4500(i2c)
+    pd.read()
+    return pd
+
+
+def _run_stusb4500_provision(pd):
+    pd.read()
+    pd.set_voltage(2, 9)
+    pd.set_current(2, 2)
+    pd.set_voltage(3, 15)
+    pd.set_current(3, 3)
+    pd.set_pdo_number(3)
+    pd.write()
+    pd.read()
+
+
+def _run_stusb4500_runtime_pdo(pd):
+    pd.set_runtime_pdos([(5, 1.5), (9, 2), (15, 3)])
+
+
+def _save_stusb4500(i2c):
+    pd = _stusb4500(i2c)
+    pd.read()
+    return pd.config, [pd.get_runtime_pdo(pdo) for pdo in (1, 2, 3)], pd.get_runtime_pdo_number()
+
+
+def _restore_stusb4500(i2c, saved):
+    config, pdos, number = saved
+    pd = _stusb4500(i2c)
+    pd.config = config
+    pd.write()
+    for pdo, (voltage, current) in enumerate(pdos, 1):
+        pd.set_runtime_pdo(pdo, voltage, current)
+    pd.set_runtime_pdo_number(number)
+    pd.renegotiate()
+
+
+def _iaq(i2c):
+    from adafruit_sgp30 import Adafruit_SGP30
+    from hts221_continuous import HTS221Continuous
+    from snapshot import SnapshotCoordinator
+
+    sgp30 = Adafruit_SGP30(i2c)
+    sgp30.set_iaq_baseline(0x8973, 0x8AAE)
+    coordinator = SnapshotCoordinator()
+    coordinator.add_climate(HTS221Continuous(i2c))
+    coordinator.add_iaq(sgp30)
+    return coordinator, sgp30
+
+
+def _run_iaq_hour(state):
+    # The iaq-poll.py schedule on a virtual clock: 0.5 s ticks, a climate and
+    # IAQ snapshot every 150 s, baseline every hour
+    coordinator, sgp30 = state
+    snapshot_update_time = baseline_update_time = -3600.0
+    for tick in range(7200):
+        now = tick * 0.5
+        if now - snapshot_update_time >= 150:
+            snapshot_update_time = now
+            coordinator.snapshot()
+        if now - baseline_update_time >= 3600:
+            baseline_update_time = now
+            sgp30.get_iaq_baseline()
+
+
+def _mlx90640(i2c):
+    import adafruit_mlx90640
+
+    mlx = adafruit_mlx90640.MLX90640(i2c)
+    mlx.refresh_rate = adafruit_mlx90640.RefreshRate.REFRESH_2_HZ
+    return mlx, [0] * 768
+
+
+def _run_mlx90640_frames(state):
+    mlx, frame = state
+    for _ in range(4):
+        while True:
+            try:
+                mlx.getFrame(frame)
+                break
+            except ValueError:
+                continue
+
+
+def _as7341(i2c):
+    from adafruit_as7341 import AS7341
+    return AS7341(i2c)
+
+
+def _run_i2c_scan(i2c):
+    import i2c_discovery
+    i2c_discovery.discover({"bench": i2c})
+
+
+SCENARIOS = {
+    # name: (setup, run, operations per run, runs on simulated bus)
+    "stusb4500_read": (_stusb4500, lambda pd: pd.read(), 1, True),
+    "stusb4500_read_hid": (_stusb4500_hid, lambda pd: pd.read(), 1, True),
+    "stusb4500_read_hid_blinka": (_stusb4500_hid_blinka, lambda pd: pd.read(), 1, True),
+    "stusb4500_write": (_stusb4500_write, lambda pd: pd.write(), 1, True),
+    "stusb4500_provision": (_stusb4500, _run_stusb4500_provision, 1, True),
+    "stusb4500_runtime_pdo": (_stusb4500, _run_stusb4500_runtime_pdo, 1, True),
+    "iaq_hour": (_iaq, _run_iaq_hour, 1, True),
+    "mlx90640_frames": (_mlx90640, _run_mlx90640_frames, 4, False),
+    "as7341_all_channels": (_as7341, lambda sensor: sensor.all_channels, 1, True),
+    "i2c_scan": (lambda i2c: i2c, _run_i2c_scan, 1, True),
+}
+
+# Scenarios that rewrite the NVM or renegotiate the contract of a live device.
+# They only run live with --allow-nvm-writes, once, and the device state is
+# put back afterwards.
+DEVICE_WRITES = {
+    # name: (save(i2c) returning the device state, restore(i2c, state))
+    "stusb4500_write": (_save_stusb4500, _restore_stusb4500),
+    "stusb4500_provision": (_save_stusb4500, _restore_stusb4500),
+    "stusb4500_runtime_pdo": (_save_stusb4500, _restore_stusb4500),
+}
+
+
+def _open_bus(mode, name, args):
+    if mode == "sim":
+        from sim_bus import SimI2C
+        return SimI2C()
+    if mode == "replay":
+        from bus_trace import ReplayI2C
+        return ReplayI2C(os.path.join(args.traces, name + ".bin"))
+
+    import bus
+    i2c = bus.I2C()
+    if args.record:
+        from bus_trace import RecordingI2C
+        os.makedirs(args.record, exist_ok=True)
+        i2c = RecordingI2C(i2c, os.path.join(args.record, name + ".bin"))
+    return i2c
+
+
+def run_scenario(name, mode, args):
+    """
+    Run a scenario and measure it
+
+    Every timing run and the allocation run set up a fresh bus, so a replayed
+    trace (one setup plus one run, as recorded) is served from the start each
+    time. Each of the ``--repeat`` timing samples repeats the run until it has
+    taken ``--min-time``, so sub-ms scenarios are not dominated by timer and
+    scheduler noise. The relative median absolute deviation of the samples is
+    kept as ``wall_time_spread``.
+
+    Scenarios in `DEVICE_WRITES` run a single time on the live bus, with
+    allocation tracing on, and the device state is restored afterwards.
+
+    :param str name: Scenario name
+    :param str mode: Bus mode, one of sim, live or replay
+    :return: Metrics of the scenario
+    :rtype: dict
+    """
+    setup, run, operations, _ = SCENARIOS[name]
+
+    def prepare():
+        i2c = CountingI2C(_open_bus(mode, name, args))
+        state = setup(i2c)
+        i2c.reset()
+        return i2c, state
+
+    if mode == "live" and name in DEVICE_WRITES:
+        import bus
+
+        # Save and restore outside the recorded trace, so it replays as usual
+        save, restore = DEVICE_WRITES[name]
+        saved = save(bus.I2C())
+        try:
+            i2c, state = prepare()
+            start = time.perf_counter()
+            peak, blocks = _allocations(run, state)
+            times = [time.perf_counter() - start]
+            _close(i2c)
+        finally:
+            restore(bus.I2C(), saved)
+        transactions, nbytes = i2c.transactions, i2c.bytes
+        hid_reports = i2c.hid.reports if i2c.hid else None
+    else:
+        times = []
+        i2c = None
+        for _ in range(args.repeat):
+            elapsed = 0.0
+            runs = 0
+            while runs == 0 or elapsed < args.min_time:
+                i2c, state = prepare()
+                gc.disable()
+                try:
+                    start = time.perf_counter()
+                    run(state)
+                    elapsed += time.perf_counter() - start
+                finally:
+                    gc.enable()
+                _close(i2c)
+                runs += 1
+            times.append(elapsed / runs)
+
+        transactions, nbytes = i2c.transactions, i2c.bytes
+        hid_reports = i2c.hid.reports if i2c.hid else None
+
+        i2c, state = prepare()
+        peak, blocks = _allocations(run, state)
+        _close(i2c)
+
+    wall_time = statistics.median(times)
+    spread = statistics.median(abs(t - wall_time) for t in times) / wall_time if wall_time else 0.0
+    return {
+        "wall_time": wall_time,
+        "wall_time_spread": spread,
+        "ops_per_sec": operations / wall_time if wall_time else 0.0,
+        "transactions": transactions,
+        "bytes": nbytes,
+        "hid_reports": hid_reports,
+        "alloc_peak": peak,
+        "alloc_blocks": blocks,
+    }
+
+
+def _allocations(run, state):
+    """Peak allocation in bytes and new memory blocks of one run"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run(state)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+
+def _close(i2c):
+    close = getattr(i2c.i2c, "close", None)
+    if close:
+        close()
+
+
+def compare(results, baseline, threshold, min_delta=DEFAULT_MIN_DELTA):
+    """
+    Compare results against a baseline
+
+    Bus transactions, bytes and HID reports are deterministic and may not
+    grow at all. Peak allocation may grow by ``threshold``, wall time by
+    ``threshold`` or `NOISE_FACTOR` times the larger measured spread,
+    whichever is more, and by at least ``min_delta`` seconds.
+
+    :param dict results: Metrics keyed by scenario
+    :param dict baseline: Baseline metrics keyed by scenario
+    :param float threshold: Allowed relative growth
+    :param float min_delta: Wall time growth in s that is always allowed
+    :return: Regression messages
+    :rtype: list
+    """
+    regressions = []
+    for name, metrics in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key in ("transactions", "bytes", "hid_reports"):
+            if metrics.get(key) is not None and reference.get(key) is not None and metrics[key] > reference[key]:
+                regressions.append("{}: {} {} > {}".format(name, key, metrics[key], reference[key]))
+        noise = NOISE_FACTOR * max(metrics.get("wall_time_spread", 0.0), reference.get("wall_time_spread", 0.0))
+        for key, allowed, delta in (("wall_time", max(threshold, noise), min_delta), ("alloc_peak", threshold, 0)):
+            if reference[key] and metrics[key] - reference[key] > max(reference[key] * allowed, delta):
+                regressions.append("{}: {} {:.4g} > {:.4g} (+{:.0f}%)".format(
+                    name, key, metrics[key], reference[key], (metrics[key] / reference[key] - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths against simulated or replayed buses")
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run, default all ({})".format(", ".join(SCENARIOS)))
+    parser.add_argument("--bus", choices=("sim", "live", "replay"), default="sim", help="bus to run against")
+    parser.add_argument("--record", help="directory to record live traces to")
+    parser.add_argument("--allow-nvm-writes", action="store_true",
+                        help="run the scenarios that write the STUSB4500 NVM or renegotiate on --bus live")
+    parser.add_argument("--traces", default="traces", help="directory with traces for --bus replay")
+    parser.add_argument("--repeat", type=int, default=5, help="timing samples per scenario")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                        help="minimum time in s per sample, short scenarios are repeated")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed relative slowdown")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA,
+                        help="slowdown in s that is always allowed")
+    args = parser.parse_args()
+
+    names = args.scenarios or list(SCENARIOS)
+    results = {}
+    print("{:<26} {:>10} {:>10} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+        "scenario", "time ms", "ops/s", "txns", "bytes", "hid", "peak B", "blocks"))
+    for name in names:
+        if args.bus == "sim" and not SCENARIOS[name][3]:
+            print("{:<26} skipped, needs --bus live or replay".format(name))
+            continue
+        if args.bus == "live" and name in DEVICE_WRITES and not args.allow_nvm_writes:
+            print("{:<26} skipped, writes the device, needs --allow-nvm-writes".format(name))
+            continue
+        if args.bus == "replay" and not os.path.exists(os.path.join(args.traces, name + ".bin")):
+            print("{:<26} skipped, no trace in {}".format(name, args.traces))
+            continue
+        try:
+            metrics = run_scenario(name, args.bus, args)
+        except ImportError as e:
+            print("{:<26} skipped, {}".format(name, e))
+            continue
+        results[name] = metrics
+        print("{:<26} {:>10.2f} {:>10.1f} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+            name, metrics["wall_time"] * 1000, metrics["ops_per_sec"], metrics["transactions"],
+            metrics["bytes"], "-" if metrics["hid_reports"] is None else metrics["hid_reports"],
+            metrics["alloc_peak"], metrics["alloc_blocks"]))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines.setdefault(args.bus, {}).update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("Baseline saved to {}".format(args.baseline))
+        return 0
+
+    regressions = compare(results, baselines.get(args.bus, {}), args.threshold, args.min_delta)
+    for regression in regressions:
+        print("REGRESSION {}".format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
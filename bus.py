@@ -0,0 +1,109 @@
+"""
+I2C bus selection for the scripts.
+
+Set ``REMOTEIO_BROKER`` to the socket of a running :mod:`i2c_broker` to share
+one MCP2221 between processes. Otherwise the adapter is opened directly
+through Blinka, or through :mod:`mcp2221_batch` when ``REMOTEIO_BATCH`` is set.
+Blinka is pointed at the MCP2221 unless ``mcp2221=False`` is passed, which
+leaves the board to Blinka's detection (or ``BLINKA_MCP2221``).
+
+``REMOTEIO_RECORD`` records all bus traffic to the given trace file and
+``REMOTEIO_REPLAY`` replays a trace instead of opening any hardware, at the
+recorded pace if ``REMOTEIO_REPLAY_REALTIME`` is set (see :mod:`bus_trace`).
+"""
+import os
+
+BROKER_ENV = "REMOTEIO_BROKER"
+BATCH_ENV = "REMOTEIO_BATCH"
+RECORD_ENV = "REMOTEIO_RECORD"
+REPLAY_ENV = "REMOTEIO_REPLAY"
+REPLAY_REALTIME_ENV = "REMOTEIO_REPLAY_REALTIME"
+
+
+def I2C(mcp2221=True):
+    """
+    Get the I2C bus, either a broker client or the MCP2221 itself
+
+    :param bool mcp2221: Set ``BLINKA_MCP2221`` if it is not set. Defaults to
+        True.
+    :return: The I2C bus
+    :rtype: busio.I2C
+    """
+    replay = os.environ.get(REPLAY_ENV)
+    if replay:
+        from bus_trace import ReplayI2C
+        return ReplayI2C(replay, realtime=bool(os.environ.get(REPLAY_REALTIME_ENV)))
+
+    record = os.environ.get(RECORD_ENV)
+    if record:
+        import atexit
+        from bus_trace import RecordingI2C
+        i2c = RecordingI2C(_open(mcp2221), record)
+        atexit.register(i2c.close)
+        return i2c
+
+    return _open(mcp2221)
+
+
+def _open(mcp2221):
+    path = os.environ.get(BROKER_ENV)
+    if path:
+        from i2c_broker import BrokerI2C
+        return BrokerI2C(path)
+
+    if mcp2221 and 'BLINKA_MCP2221' not in os.environ:
+        os.environ['BLINKA_MCP2221'] = '1'
+
+    # Batching only applies when Blinka would use an MCP2221
+    if os.environ.get(BATCH_ENV) and os.environ.get('BLINKA_MCP2221'):
+        from mcp2221_batch import BatchingI2C
+        return BatchingI2C()
+
+    import board
+    return board.I2C()
+
+
+def buses():
+    """
+    Get every attached MCP2221 as its own bus
+
+    With more than one adapter each is opened through
+    :mod:`mcp2221_batch`, since Blinka only opens the first. The broker,
+    replay and recording modes and single adapters use `I2C`.
+
+    :return: I2C buses keyed by label
+    :rtype: dict
+    """
+    if not any(os.environ.get(name) for name in (BROKER_ENV, RECORD_ENV, REPLAY_ENV)):
+        try:
+            from mcp2221_batch import adapters, open_adapter
+            found = adapters()
+        except ImportError:
+            found = []
+        if len(found) > 1:
+            # Serial numbers are not necessarily unique, the HID paths are
+            return {"MCP2221 {}".format(info["path"].decode(errors="replace")): open_adapter(info["path"])
+                    for info in found}
+
+    return {board_id(): I2C()}
+
+
+def board_id(mcp2221=True):
+    """
+    Get the board name, without opening the adapter when using the broker
+
+    :param bool mcp2221: Set ``BLINKA_MCP2221`` if it is not set, as for `I2C`
+    """
+    replay = os.environ.get(REPLAY_ENV)
+    if replay:
+        return "replay:{}".format(replay)
+
+    path = os.environ.get(BROKER_ENV)
+    if path:
+        return "broker:{}".format(path)
+
+    if mcp2221 and 'BLINKA_MCP2221' not in os.environ:
+        os.environ['BLINKA_MCP2221'] = '1'
+
+    import board
+    return board.board_id
@@ -0,0 +1,375 @@
+"""
+I2C bus trace recording and replay.
+
+``RecordingI2C`` wraps a live bus and appends every transaction to a compact
+binary trace. ``ReplayI2C`` serves the recorded responses back to unmodified
+drivers, either at the recorded pace or as fast as possible, so bus usage can
+be benchmarked and compared between versions without hardware.
+
+Trace format: an 8 byte header (``RIOT``, version, reserved) followed by one
+record per transaction::
+
+    op (u8), address (u8), status (u8), reserved (u8),
+    start (u64, us since the first transaction), duration (u32, us),
+    write length (u16), read length (u16), write data, read data
+
+A failed transaction has the status of the raised exception (OSError,
+RuntimeError or another exception) and instead of read data the exception
+class name, errno and message, separated by newlines. Replay raises the same
+exception.
+
+Version 1 traces, with a u32 start that wraps after 71 minutes, and version 2
+traces, with OSError as the only error status, can still be loaded.
+"""
+import builtins
+import collections
+import struct
+import sys
+import threading
+import time
+
+_MAGIC = b"RIOT"
+_VERSION = 3
+_HEADER = struct.Struct("<4sBxxx")
+_RECORDS = {1: struct.Struct("<BBBxIIHH"), 2: struct.Struct("<BBBxQIHH"), 3: struct.Struct("<BBBxQIHH")}
+_RECORD = _RECORDS[_VERSION]
+_MAX_DURATION = 0xFFFFFFFF
+
+OP_WRITE = 1
+OP_READ = 2
+OP_WRITE_READ = 3
+OP_SCAN = 4
+
+OP_NAMES = {OP_WRITE: "write", OP_READ: "read", OP_WRITE_READ: "write_read", OP_SCAN: "scan"}
+
+_STATUS_OK = 0
+_STATUS_OS_ERROR = 1
+_STATUS_RUNTIME_ERROR = 2
+_STATUS_OTHER_ERROR = 3
+
+_ERRORS = {_STATUS_OS_ERROR: OSError, _STATUS_RUNTIME_ERROR: RuntimeError, _STATUS_OTHER_ERROR: Exception}
+
+Transaction = collections.namedtuple(
+    "Transaction", ("op", "address", "status", "start", "duration", "write", "read")
+)
+
+
+class ReplayMismatch(RuntimeError):
+    """The driver issued a transaction that differs from the trace"""
+
+
+def _status(error):
+    for status, cls in _ERRORS.items():
+        if isinstance(error, cls):
+            return status
+    return _STATUS_OTHER_ERROR
+
+
+def _describe(error):
+    errno = getattr(error, "errno", None)
+    message = (error.strerror or "") if errno is not None else str(error)
+    return "{}\n{}\n{}".format(type(error).__name__, "" if errno is None else errno, message).encode()
+
+
+def _exception(status, read):
+    """The exception of a failed transaction, builtin classes are recreated"""
+    name, errno, message = (bytes(read).decode("utf-8", "replace").split("\n", 2) + ["", ""])[:3]
+    cls = getattr(builtins, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, BaseException)):
+        cls = _ERRORS.get(status, OSError)
+        message = "replayed {}: {}".format(name, message) if name else "replayed I2C error"
+    if errno:
+        return cls(int(errno), message)
+    return cls(message)
+
+
+class RecordingI2C:
+    """
+    ``busio.I2C`` wrapper recording every transaction to a trace file
+
+    Failing to write the trace never fails the driver call: recording stops
+    and the exception is kept in `error`.
+
+    :param i2c: The live bus
+    :type i2c: busio.I2C
+    :param str path: Trace file to write
+    """
+    def __init__(self, i2c, path):
+        self.i2c = i2c
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION))
+        self._epoch = None
+        self._lock = threading.Lock()
+        self.error = None
+
+    def _record(self, op, address, call, write=b""):
+        start = time.monotonic()
+        if self._epoch is None:
+            self._epoch = start
+        status = _STATUS_OK
+        read = b""
+        try:
+            read = call()
+        except BaseException as e:
+            status = _status(e)
+            read = _describe(e)
+            raise
+        finally:
+            self._write(op, address, status, start, time.monotonic(), write, read)
+
+    def _write(self, op, address, status, start, end, write, read):
+        with self._lock:
+            if self.error is not None:
+                return
+            try:
+                record = _RECORD.pack(
+                    op, address, status,
+                    int((start - self._epoch) * 1e6), min(int((end - start) * 1e6), _MAX_DURATION),
+                    len(write), len(read)
+                )
+                self._file.write(record + bytes(write) + bytes(read))
+            except (OSError, ValueError, struct.error) as e:
+                self.error = e
+
+    def try_lock(self):
+        return self.i2c.try_lock()
+
+    def unlock(self):
+        self.i2c.unlock()
+
+    def scan(self):
+        found = []
+
+        def call():
+            found.extend(self.i2c.scan())
+            return bytes(found)
+
+        self._record(OP_SCAN, 0, call)
+        return found
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+
+        def call():
+            self.i2c.writeto(address, data)
+            return b""
+
+        self._record(OP_WRITE, address, call, data)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+
+        def call():
+            self.i2c.readfrom_into(address, buffer, start=start, end=end)
+            return bytes(buffer[start:end])
+
+        self._record(OP_READ, address, call)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        data = bytes(buffer_out[out_start:out_end])
+        in_end = len(buffer_in) if in_end is None else in_end
+
+        def call():
+            self.i2c.writeto_then_readfrom(address, data, buffer_in, in_start=in_start, in_end=in_end)
+            return bytes(buffer_in[in_start:in_end])
+
+        self._record(OP_WRITE_READ, address, call, data)
+
+    def close(self):
+        """Close the trace file, the live bus stays open"""
+        self._file.close()
+        if self.error is not None:
+            print("Bus trace {} is incomplete: {}".format(self.path, self.error), file=sys.stderr)
+
+    def deinit(self):
+        self.close()
+        self.i2c.deinit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_trace(path):
+    """
+    Load a trace file
+
+    :param str path: Trace file
+    :return: Transactions in recorded order
+    :rtype: list
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version not in _RECORDS:
+        raise ValueError("not a version %d bus trace: %s" % (_VERSION, path))
+    record_format = _RECORDS[version]
+
+    transactions = []
+    offset = _HEADER.size
+    while offset < len(data):
+        op, address, status, start, duration, write_length, read_length = record_format.unpack_from(data, offset)
+        offset += record_format.size
+        write = data[offset:offset + write_length]
+        offset += write_length
+        read = data[offset:offset + read_length]
+        offset += read_length
+        transactions.append(Transaction(op, address, status, start / 1e6, duration / 1e6, write, read))
+    return transactions
+
+
+def summarize(transactions):
+    """
+    Count transactions and bytes per address and operation
+
+    :param transactions: Transactions as returned by :func:`load_trace`
+    :type transactions: list
+    :return: Totals and per (address, op) counts
+    :rtype: dict
+    """
+    per_device = collections.Counter()
+    for t in transactions:
+        per_device[(t.address, OP_NAMES[t.op])] += 1
+    return {
+        "transactions": len(transactions),
+        "bytes": sum(len(t.write) + len(t.read) for t in transactions),
+        "errors": sum(1 for t in transactions if t.status != _STATUS_OK),
+        "duration": transactions[-1].start + transactions[-1].duration if transactions else 0.0,
+        "per_device": dict(per_device),
+    }
+
+
+def diff(before, after):
+    """
+    Compare the transaction counts of two traces
+
+    :param before: Transactions of the reference run
+    :type before: list
+    :param after: Transactions of the new run
+    :type after: list
+    :return: Change in count per (address, op), only entries that differ
+    :rtype: dict
+    """
+    a = summarize(before)["per_device"]
+    b = summarize(after)["per_device"]
+    changes = {key: b.get(key, 0) - a.get(key, 0) for key in set(a) | set(b)}
+    return {key: change for key, change in changes.items() if change}
+
+
+class ReplayI2C:
+    """
+    ``busio.I2C`` replacement serving responses from a trace
+
+    :param trace: Trace file or transactions from :func:`load_trace`
+    :param bool realtime: Reproduce the recorded timing instead of replaying
+        as fast as possible. Defaults to False.
+    :param bool strict: Raise `ReplayMismatch` when a write differs from the
+        trace. Defaults to True. A read of another length than recorded
+        always raises it.
+    """
+    def __init__(self, trace, realtime=False, strict=True):
+        self.transactions = load_trace(trace) if isinstance(trace, str) else list(trace)
+        self.realtime = realtime
+        self.strict = strict
+        self.position = 0
+        self._epoch = None
+        self._lock = threading.Lock()
+
+    def _next(self, op, address, write=b""):
+        if self.position >= len(self.transactions):
+            raise ReplayMismatch("trace exhausted after %d transactions" % self.position)
+
+        t = self.transactions[self.position]
+        if t.op != op or t.address != address or (self.strict and t.write != bytes(write)):
+            raise ReplayMismatch(
+                "transaction %d: expected %s 0x%02X %s, got %s 0x%02X %s" % (
+                    self.position, OP_NAMES[t.op], t.address, t.write.hex(),
+                    OP_NAMES[op], address, bytes(write).hex()
+                )
+            )
+        self.position += 1
+
+        if self.realtime:
+            now = time.monotonic()
+            if self._epoch is None:
+                self._epoch = now - t.start
+            delay = self._epoch + t.start + t.duration - now
+            if delay > 0:
+                time.sleep(delay)
+
+        if t.status != _STATUS_OK:
+            raise _exception(t.status, t.read)
+        return t.read
+
+    def _read(self, op, address, length, write=b""):
+        read = self._next(op, address, write)
+        if len(read) != length:
+            raise ReplayMismatch(
+                "transaction %d: expected a %d byte %s from 0x%02X, got %d" % (
+                    self.position - 1, len(read), OP_NAMES[op], address, length
+                )
+            )
+        return read
+
+    @property
+    def remaining(self):
+        """Number of transactions not yet replayed"""
+        return len(self.transactions) - self.position
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return list(self._next(OP_SCAN, 0))
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._next(OP_WRITE, address, buffer[start:end])
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self._read(OP_READ, address, end - start)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        in_end = len(buffer_in) if in_end is None else in_end
+        buffer_in[in_start:in_end] = self._read(
+            OP_WRITE_READ, address, in_end - in_start, buffer_out[out_start:out_end]
+        )
+
+    def deinit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarise or compare I2C bus traces")
+    parser.add_argument("trace", help="trace file")
+    parser.add_argument("baseline", nargs="?", help="trace to compare against")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace)
+    summary = summarize(trace)
+    print("{transactions} transactions, {bytes} bytes, {errors} errors, {duration:.3f} s".format(**summary))
+    for (address, op), count in sorted(summary["per_device"].items()):
+        print("  0x{:02X} {:<10} {}".format(address, op, count))
+
+    if args.baseline:
+        changes = diff(load_trace(args.baseline), trace)
+        print("Changes against {}: {}".format(args.baseline, "none" if not changes else ""))
+        for (address, op), change in sorted(changes.items()):
+            print("  0x{:02X} {:<10} {:+d}".format(address, op, change))
@@ -0,0 +1,226 @@
+"""
+Per-device fault isolation for the sensor pollers.
+
+Every driver call goes through a `GuardedDevice`, which feeds a
+`CircuitBreaker`. When a device's error rate gets too high, the breaker opens
+and calls fail fast with `DeviceUnavailable` instead of hitting the bus.
+After an exponentially growing back-off, one probe is allowed through. The
+`HealthMonitor` can run these probes on a background thread, so the pollers
+only ever touch healthy devices.
+"""
+import collections
+import threading
+import time
+
+import i2c_discovery
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class DeviceUnavailable(RuntimeError):
+    """The device's circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker with exponential back-off
+
+    :param float failure_rate: Failure rate over the window that opens the
+        breaker. Defaults to 0.5.
+    :param int window: Number of recent calls the rate is computed over.
+        Defaults to 10.
+    :param int min_failures: Failures needed in the window before the breaker
+        can open. Defaults to 3.
+    :param float base_delay: First back-off in s. Defaults to 0.5.
+    :param float max_delay: Longest back-off in s. Defaults to 60.
+    """
+    def __init__(self, failure_rate=0.5, window=10, min_failures=3, base_delay=0.5, max_delay=60.0):
+        self.failure_rate = failure_rate
+        self.min_failures = min_failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = CLOSED
+        self.trips = 0
+        self.retry_at = 0.0
+        self._results = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def retry_in(self):
+        """Time in s until the next probe is allowed, 0 if calls are allowed"""
+        if self.state != OPEN:
+            return 0.0
+        return max(self.retry_at - time.monotonic(), 0.0)
+
+    def allow(self):
+        """
+        Check whether a call may go through
+
+        Once the back-off has expired, the breaker moves to half-open and
+        allows exactly one probing call.
+
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.retry_at:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._results.append(True)
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.trips = 0
+                self._results.clear()
+
+    def record_failure(self):
+        with self._lock:
+            self._results.append(False)
+            failures = self._results.count(False)
+            if self.state == HALF_OPEN or (
+                failures >= self.min_failures and failures >= self.failure_rate * len(self._results)
+            ):
+                self._trip()
+
+    def _trip(self):
+        self.trips += 1
+        delay = min(self.base_delay * 2 ** (self.trips - 1), self.max_delay)
+        self.state = OPEN
+        self.retry_at = time.monotonic() + delay
+
+
+def default_probe(driver):
+    """
+    Build a probe for a driver from its ``I2CDevice``
+
+    The probe runs the device's ID check from :mod:`i2c_discovery`, or a plain
+    address ACK for unknown devices.
+
+    :param driver: Driver with an ``i2c_device`` or ``_device`` attribute
+    :return: Callable raising OSError if the device does not respond, or None
+        if the driver has no I2C device
+    """
+    device = getattr(driver, "i2c_device", None) or getattr(driver, "_device", None)
+    if device is None:
+        return None
+
+    def probe():
+        with device:
+            if not i2c_discovery.probe(device.i2c, device.device_address):
+                raise OSError("no response from 0x%02X" % device.device_address)
+
+    return probe
+
+
+class GuardedDevice:
+    """
+    Route driver calls through a circuit breaker
+
+    :param driver: The driver to guard, e.g. `STUSB4500` or ``Adafruit_SGP30``
+    :param str name: Name used in errors. Defaults to the driver class name.
+    :param probe: Callable checking the device, raising on failure. Defaults
+        to `default_probe`.
+    :param tuple errors: Exceptions of a failing probe that `check` reports
+        as an unhealthy device instead of raising. Defaults to OSError,
+        RuntimeError and ValueError. Any exception, from a call or a probe,
+        counts as a failure.
+    :param CircuitBreaker breaker: Breaker to use. Defaults to a new one.
+    """
+    def __init__(self, driver, name=None, probe=None, errors=(OSError, RuntimeError, ValueError), breaker=None):
+        self.driver = driver
+        self.name = name or type(driver).__name__
+        self.probe = probe or default_probe(driver)
+        self.errors = errors
+        self.breaker = breaker or CircuitBreaker()
+
+    @property
+    def available(self):
+        """True if a call would be let through, False while open or probing"""
+        state = self.breaker.state
+        return state == CLOSED or (state == OPEN and self.breaker.retry_in == 0)
+
+    @property
+    def retry_in(self):
+        """Time in s until the device is tried again"""
+        return self.breaker.retry_in
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call a driver method through the breaker
+
+        :param func: Driver method or any callable using the device
+        :return: The result of the call
+        :raises DeviceUnavailable: The breaker is open
+        """
+        if not self.breaker.allow():
+            raise DeviceUnavailable("{} unavailable, retry in {:.1f} s".format(self.name, self.breaker.retry_in))
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            # Anything but success, or a half-open breaker never resolves
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def wrap(self, func):
+        """Return `func` guarded by this device's breaker"""
+        def guarded(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        return guarded
+
+    def check(self):
+        """
+        Probe the device if its back-off has expired
+
+        :return: True if the device is healthy afterwards
+        :rtype: bool
+        """
+        if self.breaker.state == CLOSED:
+            return True
+        if self.probe is None or not self.breaker.allow():
+            return False
+        try:
+            self.probe()
+        except self.errors:
+            self.breaker.record_failure()
+            return False
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return True
+
+
+class HealthMonitor:
+    """
+    Background thread probing devices with open breakers
+
+    :param list devices: `GuardedDevice` instances to watch
+    :param float interval: Time between checks in s. Defaults to 0.5.
+    """
+    def __init__(self, devices, interval=0.5):
+        self.devices = list(devices)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for device in self.devices:
+                if device.breaker.state == OPEN and device.retry_in == 0:
+                    device.check()
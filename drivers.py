@@ -0,0 +1,95 @@
+"""
+Driver registry binding discovered devices to driver instances.
+
+Driver modules are imported only when a matching device is present, so a
+gateway with two sensors never imports the other driver packages.
+"""
+import importlib
+
+import i2c_discovery
+
+# name: (module, class, default address)
+REGISTRY = {
+    "STUSB4500": ("stusb4500", "STUSB4500", 0x28),
+    "HTS221": ("adafruit_hts221", "HTS221", 0x5F),
+    "SGP30": ("adafruit_sgp30", "Adafruit_SGP30", 0x58),
+    "MLX90640": ("adafruit_mlx90640", "MLX90640", 0x33),
+    "AS7341": ("adafruit_as7341", "AS7341", 0x39),
+}
+
+
+def register(name, module, cls, address):
+    """
+    Register a driver for a fingerprinted device name
+
+    :param name: Device name as reported by :mod:`i2c_discovery`
+    :type name: str
+    :param module: Module providing the driver, imported on first use
+    :type module: str
+    :param cls: Driver class or factory name within the module
+    :type cls: str
+    :param address: Default I2C address of the device
+    :type address: int
+    """
+    REGISTRY[name] = (module, cls, address)
+
+
+def get_factory(name):
+    """
+    Import and return the driver factory for a device
+
+    :param name: Device name
+    :type name: str
+    :return: Driver class or factory
+    """
+    module, cls, _ = REGISTRY[name]
+    return getattr(importlib.import_module(module), cls)
+
+
+def create(name, i2c, address=None, **kwargs):
+    """
+    Instantiate the driver for a device
+
+    The address is only passed on when it differs from the driver default, as
+    not every driver accepts an address argument.
+
+    :param name: Device name
+    :type name: str
+    :param i2c: I2C bus the device is on
+    :type i2c: busio.I2C
+    :param address: Device address
+    :type address: int
+    :return: Driver instance
+    """
+    factory = get_factory(name)
+    if address is not None and address != REGISTRY[name][2]:
+        kwargs["address"] = address
+    return factory(i2c, **kwargs)
+
+
+def bind(i2c, devices=None, strict=False):
+    """
+    Instantiate drivers for every known device on the bus
+
+    :param i2c: I2C bus to bind drivers on
+    :type i2c: busio.I2C
+    :param devices: Results of :func:`i2c_discovery.scan_bus`, scanned if None
+    :type devices: dict
+    :param strict: Raise if a driver fails to initialise instead of skipping it
+    :type strict: bool
+    :return: Driver instances keyed by device name
+    :rtype: dict
+    """
+    if devices is None:
+        devices = i2c_discovery.scan_bus(i2c)
+
+    drivers = {}
+    for address, name in sorted(devices.items()):
+        if name not in REGISTRY:
+            continue
+        try:
+            drivers[name] = create(name, i2c, address)
+        except (OSError, RuntimeError, ValueError):
+            if strict:
+                raise
+    return drivers
@@ -0,0 +1,109 @@
+"""
+HTS221 continuous-mode acquisition.
+
+The calibration coefficients are read once at start-up. Each sample is then
+a single auto-increment burst from STATUS_REG through TEMP_OUT_H, which
+carries the data-ready bits together with both outputs, instead of the
+one-shot trigger, wait loop and separate output and calibration reads of the
+Adafruit driver.
+"""
+import struct
+from micropython import const
+
+from adafruit_bus_device.i2c_device import I2CDevice
+
+_HTS221_DEFAULT_ADDRESS = const(0x5F)
+
+_WHO_AM_I = const(0x0F)
+_HTS221_CHIP_ID = const(0xBC)
+_CTRL_REG1 = const(0x20)
+_CTRL_PD = const(0x80)
+_CTRL_BDU = const(0x04)
+_STATUS_REG = const(0x27)
+_STATUS_H_DA = const(0x02)
+_STATUS_T_DA = const(0x01)
+_CALIB_START = const(0x30)
+
+# Setting the MSB of the register address enables auto-increment
+_AUTO_INCREMENT = const(0x80)
+
+RATE_1_HZ = const(1)
+RATE_7_HZ = const(2)
+RATE_12_5_HZ = const(3)
+
+
+class HTS221Continuous:
+    """Continuous-mode reader for the HTS221 humidity and temperature sensor.
+
+    :param busio.I2C i2c: The I2C bus the HTS221 is connected to.
+    :param int rate: Output data rate, one of `RATE_1_HZ`, `RATE_7_HZ` or
+        `RATE_12_5_HZ`. Defaults to 1Hz.
+    :param int address: The I2C address of the HTS221. Defaults to 0x5F.
+
+    """
+    def __init__(self, i2c, rate=RATE_1_HZ, address=_HTS221_DEFAULT_ADDRESS):
+        assert rate in (RATE_1_HZ, RATE_7_HZ, RATE_12_5_HZ), "rate not supported"
+
+        self.i2c_device = I2CDevice(i2c, address)
+        self._buffer = bytearray(5)
+
+        if self._read_register(_WHO_AM_I, 1)[0] != _HTS221_CHIP_ID:
+            raise RuntimeError("Failed to find HTS221")
+
+        self._read_calibration()
+
+        # Power up with block data update so a burst never mixes two samples
+        with self.i2c_device as i2c:
+            i2c.write(bytes([_CTRL_REG1, _CTRL_PD | _CTRL_BDU | rate]))
+
+        self.temperature = None
+        self.relative_humidity = None
+
+    def _read_register(self, register, length):
+        """Read `length` bytes starting at the specified register"""
+        result = bytearray(length)
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(bytes([register | _AUTO_INCREMENT]), result)
+        return result
+
+    def _read_calibration(self):
+        calib = self._read_register(_CALIB_START, 16)
+
+        h0_rh = calib[0] / 2.0
+        h1_rh = calib[1] / 2.0
+        t0_degc = (calib[2] | (calib[5] & 0x03) << 8) / 8.0
+        t1_degc = (calib[3] | (calib[5] & 0x0C) << 6) / 8.0
+        h0_t0_out, = struct.unpack_from("<h", calib, 6)
+        h1_t0_out, = struct.unpack_from("<h", calib, 10)
+        t0_out, t1_out = struct.unpack_from("<hh", calib, 12)
+
+        # Linear interpolation reduced to value = out * slope + offset
+        self._h_slope = (h1_rh - h0_rh) / (h1_t0_out - h0_t0_out)
+        self._h_offset = h0_rh - h0_t0_out * self._h_slope
+        self._t_slope = (t1_degc - t0_degc) / (t1_out - t0_out)
+        self._t_offset = t0_degc - t0_out * self._t_slope
+
+    def read(self):
+        """
+        Read a sample if one is ready
+
+        Updates `temperature` and `relative_humidity` when new data is
+        available.
+
+        :return: True if a new sample was read
+        :rtype: bool
+        """
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(bytes([_STATUS_REG | _AUTO_INCREMENT]), self._buffer)
+
+        status = self._buffer[0]
+        if not status & (_STATUS_H_DA | _STATUS_T_DA):
+            return False
+
+        humidity_out, temperature_out = struct.unpack_from("<hh", self._buffer, 1)
+        if status & _STATUS_T_DA:
+            self.temperature = temperature_out * self._t_slope + self._t_offset
+        if status & _STATUS_H_DA:
+            humidity = humidity_out * self._h_slope + self._h_offset
+            self.relative_humidity = min(max(humidity, 0.0), 100.0)
+        return True
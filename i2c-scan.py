@@ -1,13 +1,40 @@
-import os
+import argparse
+import time
+import bus
+import i2c_discovery
 
-if 'BLINKA_MCP2221' not in os.environ: 
-    os.environ['BLINKA_MCP2221'] = '1'
+parser = argparse.ArgumentParser(
+    description="Scan the I2C bus of every attached MCP2221 concurrently and identify known devices")
+parser.add_argument("--verify", action="store_true", help="only re-probe addresses found by the last scan")
+parser.add_argument("--cache", default=i2c_discovery.DEFAULT_CACHE, help="scan cache file")
+args = parser.parse_args()
 
-import board
+if args.verify:
+    cached = i2c_discovery.load_cache(args.cache)
+    if not cached:
+        raise SystemExit("No scan cache at {}, run a full scan first".format(args.cache))
 
-i2c = board.I2C()
+buses = bus.buses()
 
-while not i2c.try_lock():
-    pass
+start = time.monotonic()
+if args.verify:
+    results = i2c_discovery.discover(buses, {label: list(devices) for label, devices in cached.items()})
+else:
+    results = i2c_discovery.discover(buses)
+    i2c_discovery.save_cache(results, args.cache)
+elapsed = time.monotonic() - start
 
-print("I2C addresses found: {}".format([hex(device_address) for device_address in i2c.scan()]))
+for label, devices in results.items():
+    print("I2C addresses found on {}: {}".format(label, [hex(device_address) for device_address in devices]))
+    for address, name in sorted(devices.items()):
+        print("  {}: {}".format(hex(address), name or "unknown"))
+    if args.verify:
+        missing = sorted(set(cached.get(label, {})) - set(devices))
+        if missing:
+            print("  missing: {}".format([hex(address) for address in missing]))
+
+if args.verify:
+    for label in sorted(set(cached) - set(results)):
+        print("{} from the cache is not attached".format(label))
+
+print("Scan took {:.1f} ms".format(elapsed * 1000))
@@ -0,0 +1,298 @@
+"""
+Shared I2C broker for a single MCP2221.
+
+Only one process can open the MCP2221 HID device, so the broker owns the bus
+and serves transactions to any number of client processes over a Unix socket.
+Transactions are dispatched by a weighted fair scheduler: every client gets a
+share of bus time proportional to ``2 ** priority``, so a high priority client
+(e.g. thermal frames) keeps low latency while a slow NVM programming session
+still makes progress.
+
+Run the broker with ``python i2c_broker.py`` and point clients at it with the
+``REMOTEIO_BROKER`` environment variable (see :mod:`bus`).
+"""
+import errno
+import heapq
+import itertools
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+DEFAULT_SOCKET = "/tmp/remoteio-i2c.sock"
+DEFAULT_PRIORITY = 2
+
+_OP_WRITE = 1
+_OP_READ = 2
+_OP_WRITE_READ = 3
+_OP_SCAN = 4
+
+_STATUS_OK = 0
+_STATUS_OS_ERROR = 1
+_STATUS_ERROR = 2
+
+# op, priority, address, out length, in length
+_REQUEST = struct.Struct("<BBBHH")
+# status, length
+_RESPONSE = struct.Struct("<BH")
+
+# Fixed per-transaction cost in byte equivalents, covers the HID round trips
+_TRANSACTION_COST = 8
+
+
+def _recv_exactly(sock, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError("broker connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+class _Request:
+    def __init__(self, op, address, data, read_length):
+        self.op = op
+        self.address = address
+        self.data = data
+        self.read_length = read_length
+        self.status = _STATUS_OK
+        self.result = b""
+        self.done = threading.Event()
+
+
+class FairScheduler:
+    """
+    Weighted fair queue of bus transactions executed by a single worker thread
+
+    :param i2c: The bus to run transactions on, owned by the scheduler
+    :type i2c: busio.I2C
+    """
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self._queue = []
+        self._finish = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, client, priority, request):
+        """
+        Queue a request and wait for it to complete
+
+        :param client: Key identifying the client
+        :param priority: Client priority, higher values get more bus time
+        :type priority: int
+        :param request: Request to run
+        """
+        cost = _TRANSACTION_COST + len(request.data) + request.read_length
+        with self._cond:
+            start = max(self._virtual_time, self._finish.get(client, 0.0))
+            finish = start + cost / float(1 << min(priority, 16))
+            self._finish[client] = finish
+            heapq.heappush(self._queue, (finish, next(self._seq), request))
+            self._cond.notify()
+        request.done.wait()
+
+    def forget(self, client):
+        """Drop the scheduling state of a disconnected client"""
+        with self._cond:
+            self._finish.pop(client, None)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._worker.join()
+
+    def _run(self):
+        while not self.i2c.try_lock():
+            time.sleep(0.001)
+        try:
+            while True:
+                with self._cond:
+                    while self._running and not self._queue:
+                        self._cond.wait()
+                    if not self._running:
+                        return
+                    finish, _, request = heapq.heappop(self._queue)
+                    self._virtual_time = finish
+                self._execute(request)
+                request.done.set()
+        finally:
+            self.i2c.unlock()
+
+    def _execute(self, request):
+        try:
+            if request.op == _OP_WRITE:
+                self.i2c.writeto(request.address, request.data)
+            elif request.op == _OP_READ:
+                result = bytearray(request.read_length)
+                self.i2c.readfrom_into(request.address, result)
+                request.result = bytes(result)
+            elif request.op == _OP_WRITE_READ:
+                result = bytearray(request.read_length)
+                self.i2c.writeto_then_readfrom(request.address, request.data, result)
+                request.result = bytes(result)
+            elif request.op == _OP_SCAN:
+                request.result = bytes(self.i2c.scan())
+            else:
+                raise ValueError("unknown op %d" % request.op)
+        except OSError as e:
+            request.status = _STATUS_OS_ERROR
+            request.result = str(e).encode()
+        except Exception as e:  # pylint: disable=broad-except
+            request.status = _STATUS_ERROR
+            request.result = str(e).encode()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        scheduler = self.server.scheduler
+        client = id(self)
+        try:
+            while True:
+                try:
+                    header = _recv_exactly(self.request, _REQUEST.size)
+                except ConnectionError:
+                    return
+                op, priority, address, out_length, in_length = _REQUEST.unpack(header)
+                data = _recv_exactly(self.request, out_length)
+                request = _Request(op, address, data, in_length)
+                scheduler.submit(client, priority, request)
+                self.request.sendall(_RESPONSE.pack(request.status, len(request.result)) + request.result)
+        finally:
+            scheduler.forget(client)
+
+
+def broker_alive(path=DEFAULT_SOCKET):
+    """
+    Check whether a broker is accepting connections
+
+    :param str path: Socket path of the broker
+    :rtype: bool
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+class Broker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server sharing one I2C bus between client processes
+
+    :param i2c: The bus to share
+    :type i2c: busio.I2C
+    :param str path: Socket path. Defaults to ``/tmp/remoteio-i2c.sock``.
+    """
+    daemon_threads = True
+
+    def __init__(self, i2c, path=DEFAULT_SOCKET):
+        # Only remove a stale socket, never take over a running broker
+        if broker_alive(path):
+            raise OSError(errno.EADDRINUSE, "I2C broker already running on {}".format(path))
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        self.scheduler = FairScheduler(i2c)
+
+    def server_close(self):
+        super().server_close()
+        self.scheduler.stop()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class BrokerI2C:
+    """
+    Drop-in ``busio.I2C`` replacement that forwards transactions to a broker
+
+    :param str path: Socket path of the broker
+    :param int priority: Scheduling priority, higher values get more bus time.
+        Defaults to ``REMOTEIO_PRIORITY`` or 2.
+    """
+    def __init__(self, path=DEFAULT_SOCKET, priority=None):
+        if priority is None:
+            priority = int(os.environ.get("REMOTEIO_PRIORITY", DEFAULT_PRIORITY))
+        self.priority = priority
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+
+    def _transact(self, op, address, data=b"", read_length=0):
+        with self._io_lock:
+            self._socket.sendall(_REQUEST.pack(op, self.priority, address, len(data), read_length) + bytes(data))
+            status, length = _RESPONSE.unpack(_recv_exactly(self._socket, _RESPONSE.size))
+            result = _recv_exactly(self._socket, length)
+        if status == _STATUS_OS_ERROR:
+            raise OSError(result.decode())
+        if status != _STATUS_OK:
+            raise RuntimeError(result.decode())
+        return result
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return list(self._transact(_OP_SCAN, 0))
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._transact(_OP_WRITE, address, buffer[start:end])
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self._transact(_OP_READ, address, read_length=end - start)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        in_end = len(buffer_in) if in_end is None else in_end
+        buffer_in[in_start:in_end] = self._transact(
+            _OP_WRITE_READ, address, buffer_out[out_start:out_end], in_end - in_start
+        )
+
+    def deinit(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Share the MCP2221 I2C bus between processes")
+    parser.add_argument("--socket", default=os.environ.get("REMOTEIO_BROKER", DEFAULT_SOCKET), help="socket path")
+    args = parser.parse_args()
+
+    # Check before opening the adapter, a running broker holds it
+    if broker_alive(args.socket):
+        raise SystemExit("I2C broker already running on {}".format(args.socket))
+
+    if 'BLINKA_MCP2221' not in os.environ:
+        os.environ['BLINKA_MCP2221'] = '1'
+
+    import board
+
+    with Broker(board.I2C(), args.socket) as broker:
+        print("*** I2C broker for {} on {} ***".format(board.board_id, args.socket))
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,210 @@
+"""
+I2C bus discovery and device fingerprinting.
+
+Each bus is scanned in its own thread and every responding address is probed
+with a cheap ID read to identify the devices used in this repo. Results can be
+cached and later re-verified by probing only the previously seen addresses.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "remoteio", "i2c-scan.json")
+
+_SGP30_FEATURESET_CMD = b"\x20\x2f"
+
+
+def _crc8(data):
+    """Sensirion CRC-8 (polynomial 0x31, init 0xFF)"""
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def _read_register(i2c, address, register, length):
+    result = bytearray(length)
+    i2c.writeto_then_readfrom(address, bytes(register), result)
+    return result
+
+
+def _probe_stusb4500(i2c, address):
+    # _DEVICE_ID_REG in stusb4500.py
+    return _read_register(i2c, address, [0x2F], 1)[0] == 0x21
+
+
+def _probe_hts221(i2c, address):
+    # WHO_AM_I
+    return _read_register(i2c, address, [0x0F], 1)[0] == 0xBC
+
+
+def _probe_as7341(i2c, address):
+    # WHOAMI holds the chip ID in bits 7:2
+    return _read_register(i2c, address, [0x92], 1)[0] >> 2 == 0x09
+
+
+def _probe_mlx90640(i2c, address):
+    # There is no fixed ID register, so read the device ID words from EEPROM
+    # (0x2407-0x2409) and reject a blank read
+    device_id = _read_register(i2c, address, [0x24, 0x07], 6)
+    return device_id != b"\xff" * 6
+
+
+def _probe_sgp30(i2c, address):
+    i2c.writeto(address, _SGP30_FEATURESET_CMD)
+    time.sleep(0.01)
+    result = bytearray(3)
+    i2c.readfrom_into(address, result)
+    # Product type lives in the upper nibble and is 0 for the SGP30
+    return _crc8(result[:2]) == result[2] and result[0] & 0xF0 == 0
+
+
+# address: (name, ID check)
+FINGERPRINTS = {
+    0x28: ("STUSB4500", _probe_stusb4500),
+    0x33: ("MLX90640", _probe_mlx90640),
+    0x39: ("AS7341", _probe_as7341),
+    0x58: ("SGP30", _probe_sgp30),
+    0x5F: ("HTS221", _probe_hts221),
+}
+
+
+def _lock(i2c):
+    while not i2c.try_lock():
+        time.sleep(0.001)
+
+
+def _acks(i2c, address):
+    try:
+        i2c.writeto(address, b"")
+        return True
+    except OSError:
+        return False
+
+
+def identify(i2c, address):
+    """
+    Identify the device at the given address. The bus must be locked.
+
+    :param i2c: Locked I2C bus
+    :type i2c: busio.I2C
+    :param address: Device address
+    :type address: int
+    :return: Device name, or None if the device is unknown or did not respond
+        as expected
+    :rtype: str
+    """
+    if address not in FINGERPRINTS:
+        return None
+
+    name, check = FINGERPRINTS[address]
+    try:
+        if check(i2c, address):
+            return name
+    except (OSError, RuntimeError, ValueError):
+        pass
+    return None
+
+
+def probe(i2c, address):
+    """
+    Check that the device at the given address responds. The bus must be
+    locked.
+
+    Known devices must pass their ID check, other devices only have to ACK.
+
+    :param i2c: Locked I2C bus
+    :type i2c: busio.I2C
+    :param address: Device address
+    :type address: int
+    :return: True if the device responded as expected
+    :rtype: bool
+    """
+    if address in FINGERPRINTS:
+        return identify(i2c, address) is not None
+    return _acks(i2c, address)
+
+
+def scan_bus(i2c, addresses=None):
+    """
+    Scan a single bus and fingerprint every responding address
+
+    :param i2c: I2C bus to scan
+    :type i2c: busio.I2C
+    :param addresses: Only probe these addresses instead of doing a full scan
+    :type addresses: list
+    :return: Device names (None if unknown) keyed by address
+    :rtype: dict
+    """
+    _lock(i2c)
+    try:
+        if addresses is None:
+            addresses = i2c.scan()
+            return {address: identify(i2c, address) for address in addresses}
+
+        found = {}
+        for address in addresses:
+            name = identify(i2c, address)
+            if name is None and not _acks(i2c, address):
+                continue
+            found[address] = name
+        return found
+    finally:
+        i2c.unlock()
+
+
+def discover(buses, addresses=None):
+    """
+    Scan several buses concurrently
+
+    :param buses: I2C buses keyed by label
+    :type buses: dict
+    :param addresses: Optional addresses to re-verify, keyed by bus label
+    :type addresses: dict
+    :return: Results of :func:`scan_bus` keyed by bus label
+    :rtype: dict
+    """
+    if not buses:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(buses)) as executor:
+        futures = {
+            label: executor.submit(scan_bus, i2c, None if addresses is None else addresses.get(label, []))
+            for label, i2c in buses.items()
+        }
+        return {label: future.result() for label, future in futures.items()}
+
+
+def load_cache(path=DEFAULT_CACHE):
+    """
+    Load cached discovery results
+
+    :param path: Cache file
+    :type path: str
+    :return: Results keyed by bus label, empty if there is no cache
+    :rtype: dict
+    """
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {label: {int(address, 16): name for address, name in devices.items()} for label, devices in cache.items()}
+
+
+def save_cache(results, path=DEFAULT_CACHE):
+    """
+    Save discovery results
+
+    :param results: Results keyed by bus label
+    :type results: dict
+    :param path: Cache file
+    :type path: str
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cache = {label: {hex(address): name for address, name in devices.items()} for label, devices in results.items()}
+    with open(path, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
@@ -1,37 +1,71 @@
-import os
-
-if 'BLINKA_MCP2221' not in os.environ: 
-    os.environ['BLINKA_MCP2221'] = '1'
-
-import board
+import argparse
+import async_logging
+import bus
 import logging
 import time
-from adafruit_hts221 import HTS221, Rate
+from device_health import DeviceUnavailable, GuardedDevice, HealthMonitor
+from snapshot import SnapshotCoordinator
+from hts221_continuous import HTS221Continuous, RATE_1_HZ, RATE_7_HZ, RATE_12_5_HZ
 from adafruit_sgp30 import Adafruit_SGP30
 from datetime import datetime
 
-logging.basicConfig(
-    format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
-    level=logging.INFO,
-    datefmt='%Y-%m-%d %H:%M:%S')
-logging.info("*** Indoor air quality monitor via {} ***".format(board.board_id))
+parser = argparse.ArgumentParser(description="Indoor air quality monitor")
+parser.add_argument("--climate-rate", choices=("1", "7", "12.5"), default="1", help="HTS221 output data rate in Hz")
+parser.add_argument("--light", action="store_true", help="include an AS7341 in every snapshot")
+parser.add_argument("--log-file", help="log to a size-rotated file instead of stderr")
+parser.add_argument("--log-max-bytes", type=int, default=1024 * 1024, help="log file rotation size")
+parser.add_argument("--log-backups", type=int, default=5, help="rotated log files to keep")
+parser.add_argument("--sync-log", action="store_true", help="log synchronously from the sampling loop, without rotation")
+args = parser.parse_args()
+
+if args.sync_log:
+    log_listener = None
+    logging.basicConfig(
+        filename=args.log_file,
+        format=async_logging.DEFAULT_FORMAT,
+        level=logging.INFO,
+        datefmt=async_logging.DEFAULT_DATEFMT)
+else:
+    # The sampling loop only enqueues records, a background thread writes them
+    log_listener = async_logging.basic_config(
+        filename=args.log_file,
+        max_bytes=args.log_max_bytes,
+        backup_count=args.log_backups)
+logging.info("*** Indoor air quality monitor via {} ***".format(bus.board_id()))
 
-i2c = board.I2C()
-hts = HTS221(i2c)
-hts.data_rate = Rate.ONE_SHOT
-hts.take_measurements()
+i2c = bus.I2C()
+# Continuous mode, each climate sample is a single status and output burst
+hts = HTS221Continuous(i2c, rate={"1": RATE_1_HZ, "7": RATE_7_HZ, "12.5": RATE_12_5_HZ}[args.climate_rate])
+while not hts.read():
+    time.sleep(0.1)
 first_temperature_reading = hts.temperature
 first_humidity_reading = hts.relative_humidity
 
 sgp30 = Adafruit_SGP30(i2c)
 sgp30.set_iaq_baseline(0x8973, 0x8AAE)
 
+# Climate, air quality and light are read together in one time-aligned snapshot
+# Failing sensors are backed off and probed in the background instead of
+# being retried from the sampling loop
+hts_health = GuardedDevice(hts, "HTS221")
+sgp30_health = GuardedDevice(sgp30, "SGP30")
+health = [hts_health, sgp30_health]
+
+coordinator = SnapshotCoordinator()
+coordinator.add_climate(hts, guard=hts_health)
+coordinator.add_iaq(sgp30, guard=sgp30_health)
+if args.light:
+    from adafruit_as7341 import AS7341
+    as7341 = AS7341(i2c)
+    as7341_health = GuardedDevice(as7341, "AS7341")
+    health.append(as7341_health)
+    coordinator.add_light(as7341, guard=as7341_health)
+health_monitor = HealthMonitor(health).start()
+
 eco2_tvoc_baseline = []
 valid_eco2_tvoc_baseline = False
-climate_update_time = 0
-climate_update_delay = 150
-eco2_tvoc_update_time = 0
-eco2_tvoc_update_delay = 150
+snapshot_update_time = 0
+snapshot_update_delay = 150
 eco2_tvoc_get_baseline_update_time = 0
 start_time = time.time()
 testsamples = 0
@@ -51,29 +85,41 @@ try:
     while True:
         run_time = round((time.time() - start_time), 0)
         
-        time_since_climate_update = time.time() - climate_update_time
-        if time_since_climate_update >= climate_update_delay:
-            climate_update_time = time.time()
-            hts.take_measurements()
-            logging.info("Temperature: {:.2f} C, Humidity: {:.2f} %".format(hts.temperature, hts.relative_humidity))
-            #absolute_hum = int(1000 * 216.7 * (hts.relative_humidity/100 * 6.112 * math.exp(17.62 * hts.temperature / (243.12 + hts.temperature)))
-            #               /(273.15 + hts.temperature))
-            #sgp30.set_iaq_humidity(absolute_hum)
+        time_since_snapshot = time.time() - snapshot_update_time
+        if time_since_snapshot >= snapshot_update_delay:
+            snapshot_update_time = time.time()
+            snapshot = coordinator.snapshot()
+            for name, error in snapshot.errors.items():
+                logging.warning("{} read failed: {}".format(name, error))
+            if "climate" in snapshot.values:
+                temperature, humidity = snapshot.values["climate"]
+                logging.info("Temperature: {:.2f} C, Humidity: {:.2f} %".format(temperature, humidity))
+                #absolute_hum = int(1000 * 216.7 * (humidity/100 * 6.112 * math.exp(17.62 * temperature / (243.12 + temperature)))
+                #               /(273.15 + temperature))
+                #sgp30.set_iaq_humidity(absolute_hum)
+            if "iaq" in snapshot.values:
+                eco2, tvoc = snapshot.values["iaq"]
+                logging.info("eCO2: {:d} ppm, TVOC: {:d} ppb".format(eco2, tvoc))
+            if "light" in snapshot.values:
+                logging.info("Light F1-F8: {}".format(list(snapshot.values["light"])))
+            logging.debug("Snapshot latency: {}".format(
+                ", ".join("{} {:.1f} ms".format(name, t * 1000) for name, t in snapshot.latency.items())))
 
-        time_since_eco2_tvoc = time.time() - eco2_tvoc_update_time
-        if time_since_eco2_tvoc >= eco2_tvoc_update_delay:
-            eco2_tvoc_update_time = time.time()
-            eco2, tvoc = sgp30.iaq_measure()
-            logging.info("eCO2: {:d} ppm, TVOC: {:d} ppb".format(eco2, tvoc))
-        
         # if run_time > 43200: 
         time_since_eco2_tvoc_get_baseline = time.time() - eco2_tvoc_get_baseline_update_time
         if time_since_eco2_tvoc_get_baseline >= 3600: # Update every hour
             eco2_tvoc_get_baseline_update_time = time.time()
-            eco2_tvoc_baseline = sgp30.get_iaq_baseline()
-            eco2_tvoc_baseline.append(eco2_tvoc_get_baseline_update_time)
-            logging.info("Current eCO2/TVOC Baseline: [{}, {}]".format(hex(eco2_tvoc_baseline[0]), hex(eco2_tvoc_baseline[1])))
+            try:
+                eco2_tvoc_baseline = sgp30_health.call(sgp30.get_iaq_baseline)
+                eco2_tvoc_baseline.append(eco2_tvoc_get_baseline_update_time)
+                logging.info("Current eCO2/TVOC Baseline: [{}, {}]".format(hex(eco2_tvoc_baseline[0]), hex(eco2_tvoc_baseline[1])))
+            except (DeviceUnavailable, OSError, RuntimeError) as e:
+                logging.warning("SGP30 baseline read failed: {}".format(e))
 
         time.sleep(0.5)
 except KeyboardInterrupt:
-    logging.info('Keyboard Interrupt')
\ No newline at end of file
+    logging.info('Keyboard Interrupt')
+finally:
+    health_monitor.stop()
+    if log_listener:
+        log_listener.stop()
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""
+Transaction batching layer for the MCP2221 HID transport.
+
+Every MCP2221 I2C command is one 64 byte HID report exchange. Blinka checks
+the engine state before and polls the status after every transfer, so a
+register write costs at least 4 exchanges and a write-then-read register read
+at least 7. ``BatchingI2C`` talks to the same HID device but
+
+* sends write-then-read pairs as write-no-stop plus repeated-start read and
+  collects the data in a single get-data exchange (3 exchanges),
+* pipelines writes: a write is one exchange and its completion is confirmed
+  once, before the next read or when the bus is unlocked, instead of after
+  every transfer.
+
+Minimum HID exchanges per operation, device always ready:
+
+=================================== ======== ========
+Operation                           Blinka   Batched
+=================================== ======== ========
+register write (one locked block)   4        2
+register read (write then read)     7        3
+``STUSB4500.read()``                146      68
+=================================== ======== ========
+
+Errors from pipelined writes are reported when the write is confirmed, i.e.
+at the latest when the driver releases the bus.
+
+The counts can be reproduced with ``python benchmark.py stusb4500_read_hid
+stusb4500_read_hid_blinka``, which runs both transports against
+`sim_bus.SimMCP2221`.
+"""
+import threading
+import time
+
+_CMD_STATUS = 0x10
+_CMD_I2C_WRITE = 0x90
+_CMD_I2C_READ = 0x91
+_CMD_I2C_READ_REPEATED_START = 0x93
+_CMD_I2C_WRITE_NO_STOP = 0x94
+_CMD_I2C_GET_DATA = 0x40
+
+_RESP_OK = 0x00
+_RESP_BUSY = 0x01
+_RESP_I2C_PARTIALDATA = 0x41
+_RESP_I2C_WRITINGNOSTOP = 0x45
+_RESP_ADDR_NACK = 0x25
+_RESP_READ_PARTIAL = 0x54
+_RESP_READ_COMPL = 0x55
+_RESP_READ_ERR = 0x7F
+_MASK_ADDR_NACK = 0x40
+
+_MAX_I2C_DATA = 60
+_RETRY_MAX = 50
+
+MCP2221_VID = 0x04D8
+MCP2221_PID = 0x00DD
+
+
+class MCP2221HID:
+    """
+    The part of Blinka's ``MCP2221`` that `BatchingI2C` uses, on any HID device
+
+    :param device: Opened ``hid.device``, or a simulated one
+    """
+    def __init__(self, device):
+        self._hid = device
+
+    def _hid_xfer(self, report, response=True):
+        # Report ID 0 followed by the 64 byte report
+        self._hid.write(b"\0" + report + b"\0" * (64 - len(report)))
+        if response:
+            return self._hid.read(64)
+        return None
+
+    def _i2c_configure(self, baudrate=100000):
+        # Set parameters, next byte is the clock divider
+        self._hid_xfer(bytes([_CMD_STATUS, 0x00, 0x00, 0x20, 12000000 // baudrate - 3]))
+
+    def close(self):
+        self._hid.close()
+
+
+def adapters():
+    """
+    List the attached MCP2221s
+
+    :return: HID device info (``path``, ``serial_number``, ...) per adapter
+    :rtype: list
+    """
+    import hid
+    return hid.enumerate(MCP2221_VID, MCP2221_PID)
+
+
+def open_adapter(path, frequency=100000):
+    """
+    Open one MCP2221 by HID path, independently of Blinka
+
+    Blinka only ever opens the first adapter, this opens any of them.
+
+    :param bytes path: HID path from `adapters`
+    :param int frequency: I2C clock frequency. Defaults to 100kHz.
+    :rtype: BatchingI2C
+    """
+    import hid
+    device = hid.device()
+    device.open_path(path)
+    mcp = MCP2221HID(device)
+    mcp._i2c_configure(frequency)  # pylint: disable=protected-access
+    return BatchingI2C(mcp)
+
+
+class BatchingI2C:
+    """
+    ``busio.I2C`` compatible bus driving the MCP2221 with the fewest HID reports
+
+    :param mcp: Blinka ``MCP2221`` instance. Defaults to Blinka's shared one.
+    :param int frequency: I2C clock frequency. Defaults to 100kHz.
+    """
+    def __init__(self, mcp=None, frequency=100000):
+        if mcp is None:
+            from adafruit_blinka.microcontroller.mcp2221.mcp2221 import mcp2221 as mcp
+            mcp._i2c_configure(frequency)  # pylint: disable=protected-access
+        self._mcp = mcp
+        self._lock = threading.Lock()
+        self._pending = None
+        self.exchanges = 0
+
+    def _xfer(self, report):
+        self.exchanges += 1
+        return self._mcp._hid_xfer(report)  # pylint: disable=protected-access
+
+    def _cancel(self):
+        self._xfer(bytes([_CMD_STATUS, 0x00, 0x10]))
+        self._pending = None
+
+    def _command(self, cmd, address, length, data=b""):
+        """Send an I2C command, retrying while the engine finishes the last one"""
+        # Read commands are odd and carry the read bit in the address byte
+        report = bytes([cmd, length & 0xFF, (length >> 8) & 0xFF, address << 1 | (cmd & 0x01)]) + data
+        for _ in range(_RETRY_MAX):
+            resp = self._xfer(report)
+            if resp[1] == _RESP_OK:
+                return
+            if resp[1] != _RESP_BUSY:
+                self._cancel()
+                raise RuntimeError("MCP2221 rejected I2C command 0x%02X" % cmd)
+            time.sleep(0.001)
+        self._cancel()
+        raise RuntimeError("MCP2221 I2C engine busy")
+
+    def _confirm(self):
+        """Wait for a pipelined write to complete and report its errors"""
+        if self._pending is None:
+            return
+        no_stop = self._pending == _CMD_I2C_WRITE_NO_STOP
+        self._pending = None
+        for _ in range(_RETRY_MAX):
+            status = self._xfer(bytes([_CMD_STATUS]))
+            if status[20] & _MASK_ADDR_NACK:
+                self._cancel()
+                raise OSError("I2C slave address was NACK'd")
+            if status[8] == 0 or (no_stop and status[8] == _RESP_I2C_WRITINGNOSTOP):
+                return
+            time.sleep(0.001)
+        self._cancel()
+        raise RuntimeError("Unrecoverable I2C state failure")
+
+    def _write(self, cmd, address, data):
+        length = len(data)
+        if length <= _MAX_I2C_DATA:
+            self._command(cmd, address, length, data)
+            self._pending = cmd
+            return
+
+        for start in range(0, length, _MAX_I2C_DATA):
+            self._command(cmd, address, length, data[start:start + _MAX_I2C_DATA])
+            self._pending = cmd
+            if start + _MAX_I2C_DATA < length:
+                self._wait_partial()
+
+    def _wait_partial(self):
+        for _ in range(_RETRY_MAX):
+            if self._xfer(bytes([_CMD_STATUS]))[8] != _RESP_I2C_PARTIALDATA:
+                return
+            time.sleep(0.001)
+        self._cancel()
+        raise RuntimeError("Unrecoverable I2C state failure")
+
+    def _read(self, cmd, address, buffer, start, end):
+        self._command(cmd, address, end - start)
+        while start < end:
+            for _ in range(_RETRY_MAX):
+                resp = self._xfer(bytes([_CMD_I2C_GET_DATA]))
+                if resp[1] == _RESP_I2C_PARTIALDATA or resp[3] == _RESP_READ_ERR:
+                    time.sleep(0.001)
+                    continue
+                if resp[1] != _RESP_OK:
+                    self._cancel()
+                    raise RuntimeError("Unrecoverable I2C read failure")
+                if resp[2] == _RESP_ADDR_NACK:
+                    self._cancel()
+                    raise OSError("I2C NACK")
+                if resp[2] in (_RESP_READ_COMPL, _RESP_READ_PARTIAL):
+                    break
+                time.sleep(0.001)
+            else:
+                self._cancel()
+                raise RuntimeError("Unrecoverable I2C read failure")
+
+            chunk = min(end - start, _MAX_I2C_DATA)
+            buffer[start:start + chunk] = resp[4:4 + chunk]
+            start += chunk
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        try:
+            self._confirm()
+        finally:
+            self._lock.release()
+
+    def scan(self):
+        found = []
+        for address in range(0x08, 0x78):
+            try:
+                self.writeto(address, b"")
+            except OSError:
+                continue
+            found.append(address)
+        return found
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._confirm()
+        data = bytes(buffer[start:end])
+        self._write(_CMD_I2C_WRITE, address, data)
+        if not data:
+            # Probes must see the NACK right away
+            self._confirm()
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        self._confirm()
+        end = len(buffer) if end is None else end
+        self._read(_CMD_I2C_READ, address, buffer, start, end)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        self._confirm()
+        in_end = len(buffer_in) if in_end is None else in_end
+        self._write(_CMD_I2C_WRITE_NO_STOP, address, bytes(buffer_out[out_start:out_end]))
+        # The repeated-start read is accepted once the write has finished,
+        # an address NACK shows up in the get-data response
+        self._pending = None
+        self._read(_CMD_I2C_READ_REPEATED_START, address, buffer_in, in_start, in_end)
+
+    def deinit(self):
+        # Blinka's shared MCP2221 stays open
+        if isinstance(self._mcp, MCP2221HID):
+            self._mcp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
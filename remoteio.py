@@ -0,0 +1,251 @@
+"""
+Single entry point for the scripts.
+
+``python remoteio.py <command> [args]`` runs one of the scripts in this
+directory, passing the remaining arguments through. Only the command's own
+modules are imported, so ``usb-pd`` never loads the AS7341 or SGP30 drivers.
+
+Opening the MCP2221 through Blinka enumerates the HID devices and resets the
+adapter, which takes longer than the short commands themselves. With
+``--warm`` (or ``REMOTEIO_WARM=1``) the bus is opened once by an
+:mod:`i2c_broker` daemon instead, started in the background on first use, and
+every invocation connects to its socket. ``python remoteio.py warm --stop``
+shuts the daemon down.
+
+``--timing`` prints where the start-up time of a command went and
+``python remoteio.py startup`` compares cold and warm start-up over several
+runs, e.g.::
+
+    python remoteio.py --warm usb-pd
+    python remoteio.py startup --runs 10 usb-pd
+"""
+import argparse
+import os
+import re
+import runpy
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+from i2c_broker import DEFAULT_SOCKET, broker_alive
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+WARM_ENV = "REMOTEIO_WARM"
+
+# command: (script, help)
+COMMANDS = {
+    "usb-pd": ("usb-pd.py", "print the STUSB4500 PDOs"),
+    "scan": ("i2c-scan.py", "scan the bus and identify known devices"),
+    "as7341": ("as7341-graph.py", "print the AS7341 channels"),
+    "iaq": ("iaq-poll.py", "indoor air quality monitor"),
+    "thermal": ("thermal-camera.py", "print or record MLX90640 frames"),
+    "bench": ("benchmark.py", "benchmark the hot paths"),
+    "trace": ("bus_trace.py", "summarise or compare bus traces"),
+    "broker": ("i2c_broker.py", "run the I2C broker in the foreground"),
+}
+
+_TIMING = re.compile(r"(\w+) ([\d.]+) s")
+
+
+def _process_age():
+    """Time in s since the interpreter was started, None if unknown"""
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime is field 22, counted after the parenthesised name
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def start_broker(path=DEFAULT_SOCKET, timeout=15.0):
+    """
+    Start a background broker holding the adapter open, unless one is running
+
+    The daemon's output goes to ``<path>.log`` and its pid to ``<path>.pid``.
+
+    :param str path: Socket path of the broker
+    :param float timeout: Time in s to wait for the broker to come up
+    :return: True if a broker was started
+    :rtype: bool
+    """
+    if broker_alive(path):
+        return False
+
+    with open(path + ".log", "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "i2c_broker.py"), "--socket", path],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True)
+    with open(path + ".pid", "w") as f:
+        f.write("{}\n".format(process.pid))
+
+    deadline = time.monotonic() + timeout
+    while not broker_alive(path):
+        if process.poll() is not None:
+            os.unlink(path + ".pid")
+            raise RuntimeError("broker exited with {}, see {}.log".format(process.returncode, path))
+        if time.monotonic() > deadline:
+            stop_broker(path)
+            raise RuntimeError("broker did not start within {} s, see {}.log".format(timeout, path))
+        time.sleep(0.05)
+    return True
+
+
+def stop_broker(path=DEFAULT_SOCKET):
+    """
+    Stop a broker started by `start_broker`
+
+    :param str path: Socket path of the broker
+    :return: True if a broker was stopped
+    :rtype: bool
+    """
+    try:
+        with open(path + ".pid") as f:
+            pid = int(f.read())
+    except (OSError, ValueError):
+        return False
+    os.unlink(path + ".pid")
+
+    try:
+        # SIGINT lets the broker release the adapter and remove its socket
+        os.kill(pid, signal.SIGINT)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def run_script(command, argv):
+    """Run a command's script as __main__ with the given arguments"""
+    path = os.path.join(HERE, COMMANDS[command][0])
+    sys.argv = [path] + list(argv)
+    runpy.run_path(path, run_name="__main__")
+
+
+def _timed_run(command, argv):
+    """Run a command and print its start-up phases to stderr"""
+    import bus
+
+    phases = {"interpreter": _process_age() or 0.0}
+    started = time.monotonic()
+    ready = []
+
+    # The adapter is ready once the script has its first bus
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if not ready:
+                ready.append(time.monotonic())
+            return result
+        return wrapper
+    bus.I2C = timed(bus.I2C)
+
+    try:
+        run_script(command, argv)
+    finally:
+        finished = time.monotonic()
+        adapter_ready = ready[0] if ready else started
+        phases["adapter"] = adapter_ready - started
+        phases["command"] = finished - adapter_ready
+        phases["total"] = phases["interpreter"] + finished - started
+        print("startup: " + ", ".join("{} {:.3f} s".format(name, value) for name, value in phases.items()),
+              file=sys.stderr)
+
+
+def startup_report(command, argv, runs, path):
+    """
+    Measure cold and warm start-up of a command
+
+    Every run is a fresh interpreter, the same as a provisioning script
+    calling the command.
+    """
+    def measure(warm):
+        results = []
+        for _ in range(runs):
+            args = [sys.executable, os.path.abspath(__file__), "--timing", "--socket", path]
+            if warm:
+                args.append("--warm")
+            env = dict(os.environ)
+            env.pop(WARM_ENV, None)
+            process = subprocess.run(args + [command] + list(argv), stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE, env=env, universal_newlines=True)
+            lines = [line for line in process.stderr.splitlines() if line.startswith("startup: ")]
+            if process.returncode or not lines:
+                raise RuntimeError("{} failed:\n{}".format(command, process.stderr))
+            results.append({name: float(value) for name, value in _TIMING.findall(lines[-1])})
+        return {name: statistics.median(result[name] for result in results) for name in results[0]}
+
+    was_running = broker_alive(path)
+    if was_running:
+        # The adapter is held by the broker, a cold start cannot open it
+        cold = None
+    else:
+        cold = measure(False)
+
+    start = time.monotonic()
+    start_broker(path)
+    broker_start = time.monotonic() - start
+    try:
+        warm = measure(True)
+    finally:
+        if not was_running:
+            stop_broker(path)
+
+    print("Start-up of '{}', median of {} runs (s):".format(" ".join([command] + list(argv)), runs))
+    names = ("total", "interpreter", "adapter", "command")
+    print("{:<6}".format("") + "".join("{:>13}".format(name) for name in names))
+    for label, phases in (("cold", cold), ("warm", warm)):
+        if phases is None:
+            print("{:<6}{:>13}".format(label, "skipped, broker already running"))
+        else:
+            print("{:<6}".format(label) + "".join("{:>13.3f}".format(phases[name]) for name in names))
+    if not was_running:
+        print("Starting the broker took {:.3f} s".format(broker_start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the RemoteIO scripts")
+    parser.add_argument("--warm", action="store_true", default=bool(os.environ.get(WARM_ENV)),
+                        help="keep the adapter open in a background broker between invocations")
+    parser.add_argument("--socket", default=os.environ.get("REMOTEIO_BROKER", DEFAULT_SOCKET),
+                        help="broker socket for --warm")
+    parser.add_argument("--timing", action="store_true", help="print start-up timing to stderr")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+    for name, (script, description) in COMMANDS.items():
+        # The script parses its own arguments, including --help
+        subparsers.add_parser(name, help=description, add_help=False)
+
+    warm_parser = subparsers.add_parser("warm", help="start, stop or check the warm adapter broker")
+    warm_parser.add_argument("--stop", action="store_true", help="stop the broker")
+
+    startup_parser = subparsers.add_parser("startup", help="compare cold and warm start-up of a command")
+    startup_parser.add_argument("--runs", type=int, default=5, help="runs per mode")
+    startup_parser.add_argument("target", nargs="?", default="usb-pd", choices=sorted(COMMANDS),
+                                help="command to measure")
+    startup_parser.add_argument("target_args", nargs=argparse.REMAINDER, help="arguments of the command")
+
+    args, rest = parser.parse_known_args()
+
+    if args.command == "warm":
+        if args.stop:
+            print("Broker stopped" if stop_broker(args.socket) else "No broker started from here")
+        elif start_broker(args.socket):
+            print("Broker started on {}".format(args.socket))
+        else:
+            print("Broker running on {}".format(args.socket))
+    elif args.command == "startup":
+        startup_report(args.target, args.target_args + rest, args.runs, args.socket)
+    else:
+        if args.warm and args.command != "broker":
+            start_broker(args.socket)
+            os.environ["REMOTEIO_BROKER"] = args.socket
+        if args.timing:
+            _timed_run(args.command, rest)
+        else:
+            run_script(args.command, rest)
@@ -0,0 +1,347 @@
+"""
+Simulated I2C bus with models of the devices used in this repo.
+
+The models implement just enough register behaviour for the drivers to run:
+self-clearing command bits, data-ready flags and the STUSB4500 NVM
+controller. Values are plausible but fixed, they are meant for benchmarks and
+replay-free testing, not for checking sensor maths.
+
+`SimMCP2221` puts a simulated bus behind the MCP2221 HID protocol, so the
+HID reports a transport needs per I2C operation can be counted.
+
+The MLX90640 is not modelled; its driver needs a real EEPROM calibration
+dump, use a recorded trace (see :mod:`bus_trace`) instead.
+"""
+import struct
+import threading
+import time
+
+
+class RegisterDevice:
+    """
+    Device with 8-bit register addresses and auto-increment
+
+    :param dict registers: Initial register values keyed by address
+    :param int increment_mask: Bits of the register address to ignore (e.g.
+        0x80 on ST sensors, where the MSB requests auto-increment)
+    """
+    def __init__(self, registers=None, increment_mask=0):
+        self.registers = bytearray(256)
+        for register, value in (registers or {}).items():
+            self.registers[register] = value
+        self.increment_mask = increment_mask
+        self.pointer = 0
+
+    def on_write(self, register, value):
+        """Store a register write, override for side effects"""
+        self.registers[register] = value
+
+    def on_read(self, register):
+        """Get a register value, override for side effects"""
+        return self.registers[register]
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0] & ~self.increment_mask & 0xFF
+        for value in data[1:]:
+            self.on_write(self.pointer, value)
+            self.pointer = (self.pointer + 1) & 0xFF
+
+    def read(self, length):
+        result = bytearray(length)
+        for i in range(length):
+            result[i] = self.on_read(self.pointer)
+            self.pointer = (self.pointer + 1) & 0xFF
+        return result
+
+
+class SimSTUSB4500(RegisterDevice):
+    """
+    STUSB4500 with NVM controller and PD soft reset
+
+    :param bool clear_rdo: Clear the RDO status on a soft reset until the new
+        contract is in place. Defaults to True, False keeps the old contract
+        visible instead.
+    """
+    DEFAULT_NVM = (
+        (0x00, 0x00, 0xB0, 0xAA, 0x00, 0x45, 0x00, 0x00),
+        (0x10, 0x40, 0x9C, 0x1C, 0xFF, 0x01, 0x3C, 0xDF),
+        (0x02, 0x40, 0x0F, 0x00, 0x32, 0x00, 0xFC, 0xF1),
+        (0x00, 0x19, 0x56, 0xAF, 0xF5, 0x35, 0x5F, 0x00),
+        (0x00, 0x4B, 0x90, 0x21, 0x43, 0x00, 0x40, 0xFB),
+    )
+
+    def __init__(self, clear_rdo=True):
+        super().__init__({0x2F: 0x21, 0x70: 3})
+        self.clear_rdo = clear_rdo
+        self.nvm = [bytearray(sector) for sector in self.DEFAULT_NVM]
+        self._set_rdo(3, 300, 300)
+        self._renegotiating = 0
+
+    def _set_rdo(self, position, current, max_current):
+        rdo = position << 28 | current << 10 | max_current
+        self.registers[0x91:0x95] = struct.pack("<I", rdo)
+
+    def on_write(self, register, value):
+        if register == 0x96 and value & 0x10:
+            opcode = self.registers[0x97] & 0x07
+            sector = value & 0x07
+            if opcode == 0x00 and sector < len(self.nvm):
+                self.registers[0x53:0x5B] = self.nvm[sector]
+            elif opcode == 0x06 and sector < len(self.nvm):
+                self.nvm[sector][:] = self.registers[0x53:0x5B]
+            value &= ~0x10
+        elif register == 0x1A and value == 0x26 and self.registers[0x51] == 0x0D:
+            if self.clear_rdo:
+                self.registers[0x91:0x95] = bytes(4)
+            self._renegotiating = 2
+        self.registers[register] = value
+
+    def on_read(self, register):
+        if register == 0x91 and self._renegotiating:
+            self._renegotiating -= 1
+            if not self._renegotiating:
+                position = self.registers[0x70] & 0x07
+                pdo = struct.unpack_from("<I", self.registers, 0x85 + 4 * (position - 1))[0]
+                self._set_rdo(position, pdo & 0x3FF, pdo & 0x3FF)
+        return self.registers[register]
+
+
+class SimHTS221(RegisterDevice):
+    """HTS221 reporting 25 C and 48 %rH"""
+    def __init__(self):
+        super().__init__({
+            0x0F: 0xBC,
+            0x27: 0x03,
+            # H0 = 32 %rH, H1 = 64 %rH, T0 = 20 C, T1 = 30 C
+            0x30: 64, 0x31: 128, 0x32: 160, 0x33: 240, 0x35: 0x00,
+        }, increment_mask=0x80)
+        struct.pack_into("<h", self.registers, 0x36, 0)
+        struct.pack_into("<h", self.registers, 0x3A, 8000)
+        struct.pack_into("<h", self.registers, 0x3C, 0)
+        struct.pack_into("<h", self.registers, 0x3E, 1000)
+        struct.pack_into("<hh", self.registers, 0x28, 4000, 500)
+
+    def on_write(self, register, value):
+        # Reboot and one-shot conversions complete immediately
+        if register == 0x21:
+            value &= ~0x81
+        self.registers[register] = value
+
+
+class SimAS7341(RegisterDevice):
+    """AS7341 whose SMUX commands and measurements complete immediately"""
+    def __init__(self):
+        super().__init__({0x92: 0x24, 0xA3: 0x40})
+        struct.pack_into("<6H", self.registers, 0x95, 1200, 2300, 3400, 4500, 5600, 900)
+
+    def on_write(self, register, value):
+        # SMUXEN self-clears once the SMUX command has executed
+        if register == 0x80:
+            value &= ~0x10
+        self.registers[register] = value
+
+
+def _sensirion_crc(data):
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class SimSGP30:
+    """SGP30 command interface"""
+    def __init__(self):
+        self.baseline = [0x8973, 0x8AAE]
+        self._response = []
+
+    def _words(self, command):
+        if command == 0x3682:
+            return [0x0000, 0x0123, 0x4567]
+        if command == 0x202F:
+            return [0x0020]
+        if command == 0x2008:
+            return [415, 12]
+        if command == 0x2050:
+            return [13500, 18000]
+        if command == 0x2015:
+            return list(self.baseline)
+        if command == 0x2032:
+            return [0xD400]
+        return []
+
+    def write(self, data):
+        if len(data) < 2:
+            return
+        command = data[0] << 8 | data[1]
+        if command == 0x201E and len(data) >= 8:
+            self.baseline = [data[5] << 8 | data[6], data[2] << 8 | data[3]]
+        response = bytearray()
+        for word in self._words(command):
+            pair = bytes([word >> 8, word & 0xFF])
+            response += pair + bytes([_sensirion_crc(pair)])
+        self._response = response
+
+    def read(self, length):
+        result = bytearray(self._response[:length])
+        return result + bytearray(length - len(result))
+
+
+class SimI2C:
+    """
+    ``busio.I2C`` compatible bus connecting simulated devices
+
+    :param dict devices: Device models keyed by address. Defaults to all the
+        modelled devices at their default addresses.
+    """
+    def __init__(self, devices=None):
+        if devices is None:
+            devices = {
+                0x28: SimSTUSB4500(),
+                0x39: SimAS7341(),
+                0x58: SimSGP30(),
+                0x5F: SimHTS221(),
+            }
+        self.devices = devices
+        self._lock = threading.Lock()
+
+    def _device(self, address):
+        try:
+            return self.devices[address]
+        except KeyError:
+            raise OSError("I2C NACK from 0x%02X" % address)
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._device(address).write(bytes(buffer[start:end]))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self._device(address).read(end - start)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        device = self._device(address)
+        in_end = len(buffer_in) if in_end is None else in_end
+        device.write(bytes(buffer_out[out_start:out_end]))
+        buffer_in[in_start:in_end] = device.read(in_end - in_start)
+
+    def deinit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+
+
+class SimMCP2221:
+    """
+    ``hid.device`` compatible MCP2221 serving its I2C commands from a bus
+
+    The I2C engine is always ready: every command completes within its own
+    report, so `reports` is the minimum number of HID exchanges a transport
+    needs. Reports other than the I2C and status commands are acknowledged
+    and ignored.
+
+    :param i2c: Bus the I2C commands are run on. Defaults to a new `SimI2C`.
+    :type i2c: busio.I2C
+    """
+    def __init__(self, i2c=None):
+        self.i2c = i2c or SimI2C()
+        self.reports = 0
+        self._response = bytes(64)
+        self._state = 0x00
+        self._nack = False
+        self._write = None
+        self._data = b""
+
+    def open(self, vendor_id=None, product_id=None, serial_number=None):
+        pass
+
+    def open_path(self, path):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, data):
+        """Handle an output report, the first byte is the report ID"""
+        self.reports += 1
+        report = bytes(data[1:])
+        response = bytearray(64)
+        response[0] = report[0]
+        cmd = report[0]
+        if cmd == 0x10:
+            if len(report) > 2 and report[2] == 0x10:
+                self._state = 0x00
+                self._nack = False
+                self._write = None
+            response[8] = self._state
+            response[20] = 0x40 if self._nack else 0x00
+        elif cmd in (0x90, 0x92, 0x94):
+            self._command_write(cmd, report)
+        elif cmd in (0x91, 0x93):
+            self._command_read(report)
+        elif cmd == 0x40:
+            self._get_data(response)
+        self._response = bytes(response)
+        return len(data)
+
+    def read(self, length, timeout_ms=0):
+        return list(self._response[:length])
+
+    def _run(self, func, *args):
+        while not self.i2c.try_lock():
+            time.sleep(0.001)
+        try:
+            func(*args)
+            self._nack = False
+        except OSError:
+            self._nack = True
+        finally:
+            self.i2c.unlock()
+
+    def _command_write(self, cmd, report):
+        length = report[1] | report[2] << 8
+        address = report[3] >> 1
+        if self._write is None:
+            self._write = (address, length, bytearray())
+        self._write[2].extend(report[4:4 + min(length - len(self._write[2]), 60)])
+        if len(self._write[2]) < length:
+            return
+
+        data = bytes(self._write[2])
+        self._write = None
+        self._run(self.i2c.writeto, address, data)
+        # Write-no-stop holds the bus for the repeated-start read
+        self._state = 0x45 if cmd == 0x94 and not self._nack else 0x00
+
+    def _command_read(self, report):
+        length = report[1] | report[2] << 8
+        buffer = bytearray(length)
+        self._run(self.i2c.readfrom_into, report[3] >> 1, buffer)
+        self._state = 0x00
+        self._data = bytes(buffer)
+
+    def _get_data(self, response):
+        if self._nack:
+            response[2] = 0x25
+            return
+        chunk = self._data[:60]
+        self._data = self._data[60:]
+        response[2] = 0x54 if self._data else 0x55
+        response[3] = len(chunk)
+        response[4:4 + len(chunk)] = chunk
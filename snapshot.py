@@ -0,0 +1,108 @@
+"""
+Time-aligned snapshots across the sensors on one bus.
+
+Sensors with long conversions (the AS7341 integrates for hundreds of ms) are
+started first on background threads. The quick sensors are read inline while
+those conversions run, and everything is collected into one record with a
+single monotonic timestamp and the acquisition latency of each sensor.
+"""
+import collections
+import threading
+import time
+
+# timestamp is time.monotonic() at the trigger and wall_time the matching
+# time.time(). values, latency (in s from the trigger) and errors are keyed by
+# sensor name, a failed sensor has an error instead of a value.
+Snapshot = collections.namedtuple("Snapshot", ("timestamp", "wall_time", "values", "latency", "errors"))
+
+
+class SnapshotCoordinator:
+    """Trigger several sensors together and collect their results."""
+    def __init__(self):
+        self._sensors = []
+
+    def add(self, name, acquire, background=False):
+        """
+        Add a sensor
+
+        :param name: Name of the sensor in the snapshot
+        :type name: str
+        :param acquire: Callable returning the sensor reading
+        :param background: Run on a thread started before the inline sensors,
+            for sensors that wait on long conversions
+        :type background: bool
+        """
+        self._sensors.append((name, acquire, background))
+
+    def add_climate(self, hts, name="climate", guard=None):
+        """
+        Add an HTS221, either `hts221_continuous.HTS221Continuous` or the
+        Adafruit one-shot driver
+
+        The reading is (temperature in C, relative humidity in %). Pass a
+        `device_health.GuardedDevice` as `guard` to read through its breaker,
+        the same applies to the other ``add_`` helpers.
+        """
+        if hasattr(hts, "take_measurements"):
+            def acquire():
+                hts.take_measurements()
+                return hts.temperature, hts.relative_humidity
+        else:
+            def acquire():
+                hts.read()
+                return hts.temperature, hts.relative_humidity
+        self.add(name, guard.wrap(acquire) if guard else acquire)
+
+    def add_iaq(self, sgp30, name="iaq", guard=None):
+        """
+        Add an SGP30, the reading is (eCO2 in ppm, TVOC in ppb)
+        """
+        def acquire():
+            return tuple(sgp30.iaq_measure())
+        self.add(name, guard.wrap(acquire) if guard else acquire)
+
+    def add_light(self, as7341, name="light", guard=None):
+        """
+        Add an AS7341, the reading is the ``all_channels`` tuple
+        """
+        def acquire():
+            return as7341.all_channels
+        self.add(name, guard.wrap(acquire) if guard else acquire, background=True)
+
+    def snapshot(self):
+        """
+        Read every sensor once
+
+        :return: The collected readings
+        :rtype: Snapshot
+        """
+        values = {}
+        latency = {}
+        errors = {}
+        timestamp = time.monotonic()
+        wall_time = time.time()
+
+        def run(name, acquire):
+            try:
+                values[name] = acquire()
+            except Exception as e:  # pylint: disable=broad-except
+                # Also catches driver bugs, a background thread must not die
+                # without leaving its sensor in the snapshot
+                errors[name] = e
+            latency[name] = time.monotonic() - timestamp
+
+        threads = []
+        for name, acquire, background in self._sensors:
+            if background:
+                thread = threading.Thread(target=run, args=(name, acquire), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        for name, acquire, background in self._sensors:
+            if not background:
+                run(name, acquire)
+
+        for thread in threads:
+            thread.join()
+
+        return Snapshot(timestamp, wall_time, values, latency, errors)
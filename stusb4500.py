@@ -9,6 +9,14 @@ _STUSB4500_DEFAULT_ADDRESS = const(0x28)
 _DEVICE_ID_REG = const(0x2F)
 _DEVICE_ID = const(0x21)
 
+_PD_COMMAND_CTRL = const(0x1A)
+_PD_SEND_COMMAND = const(0x26)
+_TX_HEADER_LOW = const(0x51)
+_PD_SOFT_RESET = const(0x0D)
+_DPM_PDO_NUMB = const(0x70)
+_DPM_SNK_PDO1 = const(0x85)
+_RDO_REG_STATUS = const(0x91)
+
 _FTP_CUST_PASSWORD_REG = const(0x95)
 _FTP_CUST_PASSWORD = const(0x47)
 
@@ -55,10 +63,10 @@ class STUSB4500:
 
     def _read_register(self, register, length):
         """Read `length` bytes from the specifed register"""
+        result = bytearray(length)
         with self.i2c_device as i2c:
-            i2c.write(bytes([register & 0xFF]))
-            result = bytearray(length)
-            i2c.readinto(result)
+            # Repeated start lets the bus batch the address write and the read
+            i2c.write_then_readinto(bytes([register & 0xFF]), result)
             if self.debug:
                 print("$%02X => %s" % (register, [hex(i) for i in result]))
             return result
@@ -70,6 +78,13 @@ class STUSB4500:
             if self.debug:
                 print("$%02X <= 0x%02X" % (register, value))
 
+    def _write_registers(self, register, data):
+        """Write consecutive registers starting at the specified register"""
+        with self.i2c_device as i2c:
+            i2c.write(bytes([register & 0xFF]) + bytes(data))
+            if self.debug:
+                print("$%02X <= %s" % (register, [hex(i) for i in data]))
+
     def _wait_for_exec(self):
         """Wait for a command to execute"""
         status = _FTP_CUST_REQ
@@ -514,7 +529,7 @@ class STUSB4500:
             set_voltage = int(voltage / 0.05)
             self.config[4][2] = 0xFF & set_voltage
             self.config[4][3] &= 0xFC
-            self.config[4][3] |= set_voltage << 8
+            self.config[4][3] |= (set_voltage >> 8) & 0x03
 
     def set_current(self, pdo, current):
         """
@@ -835,3 +850,164 @@ class STUSB4500:
 
         self.config[4][6] &= 0xEF
         self.config[4][6] |= value << 4
+
+    def get_runtime_pdo(self, pdo):
+        """
+        Get the voltage and current of a sink PDO from the volatile registers
+
+        :param pdo: PDO channel to read
+        :type pdo: int
+        :return: Voltage in V and current in A
+        :rtype: tuple
+        """
+        assert 1 <= pdo <= 3, "pdo channel not supported"
+
+        data = self._read_register(_DPM_SNK_PDO1 + 4 * (pdo - 1), 4)
+        value = int.from_bytes(data, "little")
+        return ((value >> 10) & 0x3FF) * 0.05, (value & 0x3FF) * 0.01
+
+    def set_runtime_pdo(self, pdo, voltage, current):
+        """
+        Set the voltage and current of a sink PDO in the volatile registers
+
+        The NVM is not touched, the new values are used from the next
+        negotiation (see `renegotiate`) until the next power cycle.
+
+        Note: PDO1 - Fixed at 5V
+              PDO2 - 5-20V, 50mV resolution
+              PDO3 - 5-20V, 50mV resolution
+
+        :param pdo: PDO channel to set
+        :type pdo: int
+        :param voltage: Voltage to set
+        :type voltage: float
+        :param current: Operating current to set in A (0-5A, 10mA resolution)
+        :type current: float
+        """
+        assert 1 <= pdo <= 3, "pdo channel not supported"
+
+        # Voltage can only be in range of 5-20V
+        if pdo == 1 or voltage < 5:
+            voltage = 5
+        elif voltage > 20:
+            voltage = 20
+
+        if current < 0:
+            current = 0
+        elif current > 5:
+            current = 5
+
+        register = _DPM_SNK_PDO1 + 4 * (pdo - 1)
+        value = int.from_bytes(self._read_register(register, 4), "little")
+        value &= ~0xFFFFF
+        value |= (int(round(voltage / 0.05)) & 0x3FF) << 10
+        value |= int(round(current / 0.01)) & 0x3FF
+        self._write_registers(register, value.to_bytes(4, "little"))
+
+    def set_runtime_pdo_number(self, value):
+        """
+        Set the number of sink PDOs in the volatile registers
+
+        :param value: Number of sink PDOs (1-3)
+        :type value: int
+        """
+        assert 1 <= value <= 3
+
+        self._write_register(_DPM_PDO_NUMB, value)
+
+    def get_runtime_pdo_number(self):
+        """
+        Get the number of sink PDOs in the volatile registers
+
+        :return: Number of sink PDOs
+        :rtype: int
+        """
+        return self._read_register(_DPM_PDO_NUMB, 1)[0] & 0x07
+
+    @staticmethod
+    def _contract(rdo):
+        return {
+            "position": (rdo >> 28) & 0x07,
+            "current": ((rdo >> 10) & 0x3FF) * 0.01,
+            "max_current": (rdo & 0x3FF) * 0.01,
+        }
+
+    def get_contract(self):
+        """
+        Get the active power contract from the RDO status register
+
+        :return: Contract with the source PDO position (0 if there is no
+            contract), operating and maximum current in A
+        :rtype: dict
+        """
+        return self._contract(int.from_bytes(self._read_register(_RDO_REG_STATUS, 4), "little"))
+
+    def renegotiate(self, timeout=1.0):
+        """
+        Soft reset the PD link so the source renegotiates with the current
+        volatile PDO registers
+
+        The new contract is detected by the RDO changing from the one before
+        the reset, or coming back after the reset cleared it. If the source
+        grants the same contract again the RDO never changes; it is accepted
+        at the end of the timeout if its operating current is the one of a
+        sink PDO.
+
+        :param timeout: Time to wait for the new contract in s
+        :type timeout: float
+        :return: The new contract (see `get_contract`) with the time taken in ms
+        :rtype: dict
+        """
+        # DPM_PDO_NUMB through the RDO status in one burst
+        status = self._read_register(_DPM_PDO_NUMB, _RDO_REG_STATUS + 4 - _DPM_PDO_NUMB)
+        currents = set()
+        for pdo in range(min(status[0] & 0x07, 3)):
+            offset = _DPM_SNK_PDO1 - _DPM_PDO_NUMB + 4 * pdo
+            currents.add(int.from_bytes(status[offset:offset + 4], "little") & 0x3FF)
+        before = int.from_bytes(status[_RDO_REG_STATUS - _DPM_PDO_NUMB:], "little")
+
+        start = time.monotonic()
+        self._write_register(_TX_HEADER_LOW, _PD_SOFT_RESET)
+        self._write_register(_PD_COMMAND_CTRL, _PD_SEND_COMMAND)
+
+        # Whether the cleared RDO is seen depends on the part and on the poll
+        # timing, so it is not required
+        cleared = False
+        rdo = before
+        while time.monotonic() - start < timeout:
+            rdo = int.from_bytes(self._read_register(_RDO_REG_STATUS, 4), "little")
+            if rdo == 0:
+                cleared = True
+            elif cleared or rdo != before:
+                break
+            time.sleep(0.001)
+        else:
+            if rdo == 0 or (rdo >> 10) & 0x3FF not in currents:
+                raise RuntimeError("no new contract after %.1f s" % timeout)
+
+        contract = self._contract(rdo)
+        contract["latency_ms"] = (time.monotonic() - start) * 1000
+        return contract
+
+    def set_runtime_pdos(self, pdos, timeout=1.0):
+        """
+        Reconfigure the sink PDOs at runtime and renegotiate
+
+        :param pdos: (voltage, current) for PDO1 up to PDO3
+        :type pdos: list
+        :param timeout: Time to wait for the new contract in s
+        :type timeout: float
+        :return: The new contract (see `renegotiate`), latency includes the
+            register writes
+        :rtype: dict
+        """
+        assert 1 <= len(pdos) <= 3, "1 to 3 PDOs supported"
+
+        start = time.monotonic()
+        for pdo, (voltage, current) in enumerate(pdos, 1):
+            self.set_runtime_pdo(pdo, voltage, current)
+        self.set_runtime_pdo_number(len(pdos))
+
+        contract = self.renegotiate(timeout)
+        contract["latency_ms"] = (time.monotonic() - start) * 1000
+        return contract
@@ -0,0 +1,67 @@
+"""Record transactions against the simulated bus and replay them"""
+import pytest
+
+from bus_trace import RecordingI2C, ReplayI2C, ReplayMismatch, load_trace
+from sim_bus import SimI2C, SimSTUSB4500
+from stusb4500 import STUSB4500
+
+
+class BusyDevice:
+    """Device failing like Blinka's MCP2221 does on a stuck transfer"""
+    def write(self, data):
+        raise RuntimeError("I2C write error, max retries reached.")
+
+    def read(self, length):
+        raise RuntimeError("I2C read error, max retries reached.")
+
+
+@pytest.fixture
+def trace(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    with RecordingI2C(SimI2C({0x28: SimSTUSB4500(), 0x40: BusyDevice()}), path) as i2c:
+        STUSB4500(i2c).read()
+        with pytest.raises(OSError):
+            i2c.writeto(0x10, b"\x00")
+        with pytest.raises(RuntimeError):
+            i2c.readfrom_into(0x40, bytearray(2))
+        assert i2c.error is None
+    return path
+
+
+def test_replay_matches_recording(trace):
+    recorded = SimI2C({0x28: SimSTUSB4500()})
+    expected = STUSB4500(recorded)
+    expected.read()
+
+    i2c = ReplayI2C(trace)
+    pd = STUSB4500(i2c)
+    pd.read()
+    assert pd.config == expected.config
+
+    with pytest.raises(OSError, match="NACK from 0x10"):
+        i2c.writeto(0x10, b"\x00")
+    with pytest.raises(RuntimeError, match="max retries") as error:
+        i2c.readfrom_into(0x40, bytearray(2))
+    assert type(error.value) is RuntimeError  # pylint: disable=unidiomatic-typecheck
+    assert i2c.remaining == 0
+
+    statuses = [t.status for t in load_trace(trace)]
+    assert statuses[-2:] == [1, 2]
+
+
+def test_replay_read_length_mismatch(tmp_path):
+    path = str(tmp_path / "trace.bin")
+    with RecordingI2C(SimI2C(), path) as i2c:
+        i2c.writeto_then_readfrom(0x28, b"\x91", bytearray(4))
+        i2c.readfrom_into(0x28, bytearray(2))
+
+    i2c = ReplayI2C(path)
+    buffer = bytearray(2)
+    with pytest.raises(ReplayMismatch, match="expected a 4 byte"):
+        i2c.writeto_then_readfrom(0x28, b"\x91", buffer)
+    assert buffer == bytearray(2)
+
+    buffer = bytearray(3)
+    with pytest.raises(ReplayMismatch, match="expected a 2 byte"):
+        i2c.readfrom_into(0x28, buffer)
+    assert buffer == bytearray(3)
@@ -1,24 +1,58 @@
-import board
+import argparse
+import time
+import bus
 import adafruit_mlx90640
+from device_health import DeviceUnavailable, GuardedDevice, HealthMonitor
 
-i2c = board.I2C()
+parser = argparse.ArgumentParser(description="Print or record MLX90640 thermal frames")
+parser.add_argument("--record", help="record frames to a memory-mapped file instead of printing them")
+parser.add_argument("--frames", type=int, default=7200, help="number of frames to record")
+parser.add_argument("--dtype", choices=("float16", "int16"), default="float16", help="recorded frame type")
+args = parser.parse_args()
+
+recorder = None
+if args.record:
+    from thermal_recording import ThermalRecorder
+    recorder = ThermalRecorder(args.record, args.frames, dtype=args.dtype)
+
+# Any I2C bus Blinka detects, not only the MCP2221
+i2c = bus.I2C(mcp2221=False)
 
 mlx = adafruit_mlx90640.MLX90640(i2c)
 print("MLX addr detected on I2C", [hex(i) for i in mlx.serial_number])
 
 mlx.refresh_rate = adafruit_mlx90640.RefreshRate.REFRESH_2_HZ
 
+# Repeated frame errors open the breaker, the camera is then probed in the
+# background with back-off instead of retried in a tight loop
+camera = GuardedDevice(mlx, "MLX90640")
+HealthMonitor([camera]).start()
+
 frame = [0] * 768
-while True:
-    try:
-        mlx.getFrame(frame)
-    except ValueError:
-        # these happen, no biggie - retry
-        continue
-
-    for h in range(24):
-        for w in range(32):
-            t = frame[h*32 + w]
-            print("%0.1f, " % t, end="")
+try:
+    while recorder is None or recorder.count < recorder.capacity:
+        try:
+            camera.call(mlx.getFrame, frame)
+        except DeviceUnavailable:
+            time.sleep(camera.retry_in or 0.1)
+            continue
+        except (OSError, ValueError):
+            # these happen, no biggie - retry
+            continue
+
+        if recorder:
+            recorder.append(frame)
+            continue
+
+        for h in range(24):
+            for w in range(32):
+                t = frame[h*32 + w]
+                print("%0.1f, " % t, end="")
+            print()
         print()
-    print()
\ No newline at end of file
+except KeyboardInterrupt:
+    pass
+finally:
+    if recorder:
+        recorder.close()
+        print("Recorded {} frames to {}".format(recorder.count, args.record))
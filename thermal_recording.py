@@ -0,0 +1,181 @@
+"""
+Memory-mapped recording format for MLX90640 thermal frames.
+
+A recording is preallocated for a fixed number of frames, so appending a
+frame is a copy into the mapping and a header update, and any frame can be
+located in O(1). Playback maps the file read-only: multi-GB recordings open
+instantly and frames are handed out as NumPy views without copying.
+
+Layout (little endian)::
+
+    header      64 bytes, see _HEADER
+    timestamps  float64[capacity], seconds since the epoch
+    frames      dtype[capacity, rows, cols], starting on a 64 byte boundary
+
+int16 recordings store ``round(celsius / scale)``, float16 recordings store
+degrees Celsius directly.
+"""
+import struct
+import time
+
+import numpy as np
+
+_MAGIC = b"RIOTHERM"
+_VERSION = 1
+# magic, version, dtype code, rows, cols, scale, capacity, count
+_HEADER = struct.Struct("<8sHHHHdQQ")
+_HEADER_SIZE = 64
+_COUNT_OFFSET = _HEADER.size - 8
+
+_DTYPES = {0: np.dtype("<f2"), 1: np.dtype("<i2")}
+_DTYPE_CODES = {"float16": 0, "int16": 1}
+
+MLX90640_SHAPE = (24, 32)
+
+
+def _frames_offset(capacity):
+    offset = _HEADER_SIZE + 8 * capacity
+    return (offset + 63) // 64 * 64
+
+
+class ThermalRecorder:
+    """
+    Append frames to a preallocated, memory-mapped recording
+
+    :param str path: Recording file, overwritten if it exists
+    :param int capacity: Maximum number of frames
+    :param str dtype: ``float16`` or ``int16``. Defaults to float16.
+    :param float scale: Degrees Celsius per count for int16 recordings.
+        Defaults to 0.01.
+    :param tuple shape: Frame shape. Defaults to the MLX90640's 24x32.
+    """
+    def __init__(self, path, capacity, dtype="float16", scale=0.01, shape=MLX90640_SHAPE):
+        if dtype not in _DTYPE_CODES:
+            raise ValueError("dtype must be float16 or int16")
+
+        self.path = path
+        self.capacity = capacity
+        self.shape = tuple(shape)
+        self.scale = scale
+        self.count = 0
+        self._dtype = _DTYPES[_DTYPE_CODES[dtype]]
+
+        frames_offset = _frames_offset(capacity)
+        size = frames_offset + capacity * self.shape[0] * self.shape[1] * self._dtype.itemsize
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, _DTYPE_CODES[dtype], self.shape[0], self.shape[1],
+                                 scale, capacity, 0))
+            # Sparse where the filesystem allows it
+            f.truncate(size)
+
+        self._count = np.memmap(path, dtype="<u8", mode="r+", offset=_COUNT_OFFSET, shape=(1,))
+        self.timestamps = np.memmap(path, dtype="<f8", mode="r+", offset=_HEADER_SIZE, shape=(capacity,))
+        self.frames = np.memmap(path, dtype=self._dtype, mode="r+", offset=frames_offset,
+                                shape=(capacity,) + self.shape)
+
+    def append(self, frame, timestamp=None):
+        """
+        Append a frame
+
+        :param frame: Frame in degrees Celsius, flat (e.g. the list filled by
+            ``getFrame``) or already shaped
+        :type frame: array_like
+        :param timestamp: Capture time in s since the epoch. Defaults to now.
+        :type timestamp: float
+        :return: Index of the frame
+        :rtype: int
+        """
+        if self.count >= self.capacity:
+            raise IndexError("recording full ({} frames)".format(self.capacity))
+
+        data = np.asarray(frame, dtype=np.float32).reshape(self.shape)
+        if self._dtype.kind == "i":
+            data = np.clip(np.rint(data / self.scale), -32768, 32767)
+        self.frames[self.count] = data
+        self.timestamps[self.count] = time.time() if timestamp is None else timestamp
+
+        # Publish the frame only once its data is in place
+        self.count += 1
+        self._count[0] = self.count
+        return self.count - 1
+
+    def flush(self):
+        """Write the mapped pages to disk"""
+        self.frames.flush()
+        self.timestamps.flush()
+        self._count.flush()
+
+    def close(self):
+        self.flush()
+        del self.frames, self.timestamps, self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ThermalRecording:
+    """
+    Read-only random access to a recording
+
+    Indexing returns a NumPy view of the stored frame (float16 degrees, or
+    raw int16 counts); use `celsius` for a converted copy.
+
+    :param str path: Recording file
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+        magic, version, dtype_code, rows, cols, scale, capacity, count = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("not a version %d thermal recording: %s" % (_VERSION, path))
+
+        self.path = path
+        self.shape = (rows, cols)
+        self.scale = scale
+        self.capacity = capacity
+        self.dtype = _DTYPES[dtype_code]
+
+        # A recording may be cut short, only map frames that were published
+        self.count = count
+        self.timestamps = np.memmap(path, dtype="<f8", mode="r", offset=_HEADER_SIZE, shape=(capacity,))[:count]
+        self.frames = np.memmap(path, dtype=self.dtype, mode="r", offset=_frames_offset(capacity),
+                                shape=(capacity,) + self.shape)[:count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def celsius(self, index):
+        """
+        Get frame(s) converted to degrees Celsius
+
+        :param index: Frame index or slice
+        :return: float32 copy of the frame(s)
+        :rtype: numpy.ndarray
+        """
+        frames = self.frames[index].astype(np.float32)
+        if self.dtype.kind == "i":
+            frames *= self.scale
+        return frames
+
+    def index_at(self, timestamp):
+        """
+        Get the index of the last frame captured at or before a time
+
+        :param float timestamp: Time in s since the epoch
+        :return: Frame index, -1 if the time is before the first frame
+        :rtype: int
+        """
+        return int(np.searchsorted(self.timestamps, timestamp, side="right")) - 1
+
+    @property
+    def duration(self):
+        """Time in s between the first and last frame"""
+        if self.count < 2:
+            return 0.0
+        return float(self.timestamps[-1] - self.timestamps[0])
@@ -1,14 +1,9 @@
-import os
-
-if 'BLINKA_MCP2221' not in os.environ: 
-    os.environ['BLINKA_MCP2221'] = '1'
-
-import board
+import bus
 from stusb4500 import STUSB4500
 
-print("*** STUSB4500 controller via {} ***".format(board.board_id))
+print("*** STUSB4500 controller via {} ***".format(bus.board_id()))
 
-i2c = board.I2C()
+i2c = bus.I2C()
 pd = STUSB4500(i2c)
 pd.read()
 